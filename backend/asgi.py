@@ -0,0 +1,440 @@
+import asyncio
+import random
+import time
+
+from a2wsgi import WSGIMiddleware
+from databases import Database
+from sqlalchemy import select, func, text
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+from werkzeug.http import generate_etag, parse_etags, quote_etag
+
+from flaskr import create_app, read_page_args, split_page, int_arg, \
+    caches_lag, client_wrote_within, wrote_recently, \
+    TRIVIA_FRONTEND_ORIGIN, ROUTE_CLASSES
+from flaskr.admission import retry_after
+from flaskr.question_pool import index_ids, pick_unseen
+from flaskr.serialization import get_json_encoder
+from models import setup_db, changed_within, Question, Category, \
+    QuestionRow, QUESTION_FIELDS, format_question_row, questions_version, \
+    categories_version
+
+# ASGI serving mode
+#     `uvicorn --factory asgi:create_asgi_app` serves the read and quiz
+#     endpoints from coroutines over an async database driver (asyncpg for
+#     PostgreSQL, aiosqlite for SQLite), so waiting on the database does not
+#     hold a worker thread. Every other route is served by the Flask app,
+#     run in a thread pool, with the same JSON contracts. With
+#     QUESTION_INDEX the category questions and quizzes are served by the
+#     Flask app too, from its in-memory index.
+#     Needs requirements-asgi.txt
+
+QUESTION_COLUMNS = [getattr(Question, f) for f in QUESTION_FIELDS]
+
+ERROR_MESSAGES = {
+    400: "Bad request",
+    404: "Resource not found",
+    429: "Too many requests",
+    500: "Internal server Error",
+}
+
+
+class AsyncVersionedCache:
+    # flaskr.cache.VersionedCache for coroutine loaders
+
+    def __init__(self, load, version, ttl=60):
+        self.load = load
+        self.version = version
+        self.ttl = ttl
+        self._lock = asyncio.Lock()
+        self._entry = None
+
+    async def get(self):
+        entry = self._entry
+        if entry is None or self._is_stale(entry, time.monotonic()):
+            async with self._lock:
+                entry = self._entry
+                now = time.monotonic()
+                if entry is None or self._is_stale(entry, now):
+                    version = self.version.value
+                    entry = (await self.load(), version, now)
+                    self._entry = entry
+        return entry[0]
+
+    def invalidate(self):
+        self._entry = None
+
+    def _is_stale(self, entry, now):
+        _, version, loaded_at = entry
+        if version != self.version.value:
+            return True
+        return self.ttl is not None and now - loaded_at > self.ttl
+
+
+def create_asgi_app(test_config=None, database_path=None):
+    flask_app = create_app(test_config)
+    if database_path is not None:
+        setup_db(flask_app, database_path)
+    config = flask_app.config
+    dumps = get_json_encoder(config["JSON_BACKEND"])
+    metrics = flask_app.extensions['trivia_metrics']
+    last_write = flask_app.extensions['trivia_last_write_signer']
+    admission = flask_app.extensions['trivia_admission']
+    cache_lag = caches_lag(config)
+
+    database_options = {}
+    if config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql") and \
+            config.get("DB_POOL_SIZE"):
+        database_options["max_size"] = config["DB_POOL_SIZE"]
+    database = Database(config["SQLALCHEMY_DATABASE_URI"],
+                        **database_options)
+    replicas = [Database(url, **database_options)
+                for url in config["DB_REPLICA_URLS"]]
+
+    def read_database(request=None):
+        # a replica unless the client of the request or this worker wrote
+        # recently, as flaskr routes reads
+        lag = config["DB_REPLICA_LAG"]
+        if not replicas or changed_within(lag):
+            return database
+        if request is not None and \
+                wrote_recently(request.cookies, lag, last_write):
+            return database
+        return random.choice(replicas)
+
+    def fresh_reads(request):
+        # whether the client wrote within cache_lag and reads past the
+        # caches, as flaskr does
+        return client_wrote_within(request.cookies, cache_lag, last_write)
+
+    async def load_categories():
+        rows = await read_database().fetch_all(
+            select([Category.id, Category.type]).order_by(Category.id))
+        return {row[0]: row[1] for row in rows}
+
+    async def load_counts():
+        rows = await read_database().fetch_all(
+            select([Question.category, func.count(Question.id)])
+            .group_by(Question.category))
+        return {row[0]: row[1] for row in rows}
+
+    async def load_estimate():
+        # flaskr.cache.QuestionCounts: the planner statistics of PostgreSQL
+        if not config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
+            return None
+        estimate = await read_database().fetch_val(
+            text("SELECT reltuples::bigint FROM pg_class "
+                 "WHERE relname = :table"),
+            {"table": Question.__tablename__})
+        # reltuples is -1 (or 0) until the table is first analyzed
+        if estimate is None or estimate <= 0:
+            return None
+        return estimate
+
+    async def count_questions(request, where=None):
+        query = select([func.count(Question.id)])
+        if where is not None:
+            query = query.where(where)
+        return await read_database(request).fetch_val(query)
+
+    async def total_questions(request):
+        if fresh_reads(request):
+            return await count_questions(request)
+        if config["ESTIMATE_QUESTION_TOTAL"]:
+            estimate = await estimates.get()
+            if estimate is not None:
+                return estimate
+        return sum((await counts.get()).values())
+
+    async def load_ids(request=None):
+        rows = await read_database(request).fetch_all(
+            select([Question.id, Question.category, Question.difficulty])
+            .order_by(Question.id))
+        return index_ids((row[0], row[1], row[2]) for row in rows)
+
+    categories = AsyncVersionedCache(
+        load_categories, categories_version, config["CATEGORY_CACHE_TTL"])
+    counts = AsyncVersionedCache(
+        load_counts, questions_version, config["QUESTION_COUNT_TTL"])
+    estimates = AsyncVersionedCache(
+        load_estimate, questions_version, config["QUESTION_COUNT_TTL"])
+    question_ids = AsyncVersionedCache(
+        load_ids, questions_version, config["QUESTION_POOL_TTL"])
+
+    def json_response(request, payload, status=200):
+        response = Response(dumps(payload), status_code=status,
+                            media_type="application/json")
+        # the headers the Flask app adds with flask-cors and after_request
+        if request.headers.get("origin") == TRIVIA_FRONTEND_ORIGIN:
+            response.headers["Access-Control-Allow-Origin"] = \
+                TRIVIA_FRONTEND_ORIGIN
+            response.headers["Vary"] = "Origin"
+        response.headers["Access-Control-Allow-Headers"] = \
+            "Content-Type, Authorization"
+        response.headers["Access-Control-Allow-Methods"] = \
+            "GET,POST,PUT,PATCH,DELETE,OPTIONS"
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        return response
+
+    def error_response(request, status):
+        return json_response(request, {
+            "error": status,
+            "success": False,
+            "message": ERROR_MESSAGES[status]
+        }, status)
+
+    def invalid_field(request, field):
+        # flaskr.create_custom_bad_request
+        return json_response(request, {
+            "error": 400,
+            "success": False,
+            "message": f"Field: {field} is invalid"
+        }, 400)
+
+    def conditional(request, response):
+        # ETag and If-None-Match as flaskr.cached_response
+        etag = generate_etag(response.body)
+        response.headers["ETag"] = quote_etag(etag)
+        if_none_match = parse_etags(request.headers.get("if-none-match"))
+        if not if_none_match.contains_weak(etag):
+            return response
+        headers = {name: value for name, value in response.headers.items()
+                   if name not in ("content-length", "content-type")}
+        return Response(status_code=304, headers=headers)
+
+    async def fetch_page(request, where=None):
+        # questions of the requested page, the next cursor and the error
+        # status, as flaskr.paginate_questions
+        try:
+            page, per_page, after_id = read_page_args(request.query_params)
+        except ValueError:
+            return None, None, 400
+
+        query = select(QUESTION_COLUMNS).order_by(Question.id)
+        if where is not None:
+            query = query.where(where)
+        if after_id is not None:
+            query = query.where(Question.id > after_id)
+        else:
+            query = query.offset((page - 1) * per_page)
+
+        rows = await read_database(request).fetch_all(
+            query.limit(per_page + 1))
+        if after_id is None and page != 1 and not rows:
+            return None, None, 404
+
+        questions = [QuestionRow(*(row[f] for f in QUESTION_FIELDS))
+                     for row in rows]
+        questions, next_cursor = split_page(questions, per_page)
+        return questions, next_cursor, None
+
+    async def fetch_question(request, question_id):
+        row = await read_database(request).fetch_one(
+            select(QUESTION_COLUMNS).where(Question.id == question_id))
+        if row is None:
+            return None
+        return format_question_row(row[f] for f in QUESTION_FIELDS)
+
+    async def get_categories(request):
+        response = json_response(request, {
+            "success": True,
+            "categories": await categories.get()
+        })
+        response.headers["Cache-Control"] = \
+            f"public, max-age={config['CATEGORY_CACHE_MAX_AGE']}"
+        return conditional(request, response)
+
+    async def get_questions(request):
+        questions, next_cursor, error = await fetch_page(request)
+        if error:
+            return error_response(request, error)
+
+        return conditional(request, json_response(request, {
+            "success": True,
+            "questions": [format_question_row(q) for q in questions],
+            "total_questions": await total_questions(request),
+            "categories": await categories.get(),
+            "current_category": None,
+            "next_cursor": next_cursor
+        }))
+
+    async def get_category_questions(request, category_id):
+        if category_id not in await categories.get():
+            return error_response(request, 404)
+
+        in_category = Question.category == category_id
+        questions, next_cursor, error = await fetch_page(request,
+                                                         in_category)
+        if error:
+            return error_response(request, error)
+
+        if fresh_reads(request):
+            total = await count_questions(request, in_category)
+        else:
+            total = (await counts.get()).get(category_id, 0)
+
+        return conditional(request, json_response(request, {
+            "success": True,
+            "questions": [format_question_row(q) for q in questions],
+            "current_category": category_id,
+            "total_questions": total,
+            "next_cursor": next_cursor
+        }))
+
+    async def quizzes(request):
+        # request.get_json() of flaskr: no body without a JSON content
+        # type, 400 for a JSON body that does not parse
+        data = None
+        mimetype = request.headers.get("content-type", "").split(";")[0]
+        if mimetype == "application/json" or mimetype.endswith("+json"):
+            try:
+                data = await request.json()
+            except ValueError:
+                return error_response(request, 400)
+        if data is not None and not isinstance(data, dict):
+            return error_response(request, 400)
+
+        previous_questions = []
+        category = None
+        if data:
+            previous_questions = data.get("previous_questions", [])
+            quiz_category = data.get("quiz_category", None)
+            if quiz_category and (not isinstance(quiz_category, dict) or
+                                  "type" not in quiz_category):
+                return invalid_field(request, "quiz_category")
+            if quiz_category and quiz_category['type'] != "ALL":
+                category = int_arg(quiz_category, 'id')
+                if category not in await categories.get():
+                    return error_response(request, 404)
+
+        try:
+            seen = set(int(i) for i in previous_questions)
+        except (TypeError, ValueError):
+            return invalid_field(request, "previous_questions")
+
+        fresh = fresh_reads(request)
+        question = None
+        for _ in range(2):
+            if fresh:
+                all_ids, by_category, _ = await load_ids(request)
+            else:
+                all_ids, by_category, _ = await question_ids.get()
+            ids = all_ids if category is None else by_category.get(category)
+            question_id = pick_unseen(ids, seen)
+            if question_id is None:
+                break
+            question = await fetch_question(request, question_id)
+            if question is not None:
+                break
+            # deleted by another worker since the ids were loaded
+            question_ids.invalidate()
+
+        return json_response(request, {
+            "success": True,
+            "question": question
+        })
+
+    def route(method, path):
+        # (handler, path params, endpoint of the same flaskr route) of the
+        # async routes, None for the others
+        parts = path.strip("/").split("/")
+        indexed = config["QUESTION_INDEX"]
+        if method == "GET" and parts == ["categories"]:
+            return get_categories, {}, "categories"
+        if method == "GET" and parts == ["questions"]:
+            return get_questions, {}, "get_questions"
+        if method == "GET" and not indexed and len(parts) == 3 and \
+                parts[0] == "categories" and parts[2] == "questions" and \
+                parts[1].isdigit():
+            return get_category_questions, \
+                {"category_id": int(parts[1])}, "get_category_questions"
+        if method == "POST" and not indexed and parts == ["quizzes"]:
+            return quizzes, {}, "quizzes"
+        return None
+
+    def too_many_requests(request, route_class, reason, wait):
+        metrics.count_rejection(route_class, reason)
+        metrics.count_error(429)
+        response = error_response(request, 429)
+        response.headers["Retry-After"] = retry_after(wait)
+        return response
+
+    async def admit(request, route_class):
+        # the admission control of the Flask app: a 429 response, or None
+        # when the request may run and admission.leave() must follow
+        client_key = config["RATE_LIMIT_CLIENT"]
+        if client_key:
+            client = client_key(request)
+        else:
+            client = request.client.host if request.client else None
+        wait = admission.rate_limit(route_class, client)
+        if wait:
+            return too_many_requests(request, route_class, "rate", wait)
+
+        # waiting in the queue blocks, so it is done off the event loop
+        if not await run_in_threadpool(admission.enter, route_class):
+            return too_many_requests(request, route_class, "concurrency", 1)
+        return None
+
+    async def handle(request, handler, params, endpoint):
+        # admission, errors and request metrics as the Flask app
+        start = time.perf_counter()
+        route_class = ROUTE_CLASSES.get(endpoint)
+        response = None
+        if route_class is not None:
+            response = await admit(request, route_class)
+
+        if response is None:
+            try:
+                response = await handler(request, **params)
+            except Exception:
+                flask_app.logger.exception("%s %s", request.method,
+                                           request.url.path)
+                metrics.count_error(500)
+                response = error_response(request, 500)
+            finally:
+                if route_class is not None:
+                    admission.leave(route_class)
+
+        if response.status_code in (400, 404):
+            metrics.count_error(response.status_code)
+        metrics.observe_request(endpoint, request.method,
+                                response.status_code,
+                                time.perf_counter() - start, 0, 0.0)
+        return response
+
+    wsgi = WSGIMiddleware(flask_app)
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await lifespan(receive, send)
+            return
+
+        if scope["type"] == "http":
+            matched = route(scope["method"], scope["path"])
+            if matched is not None:
+                handler, params, endpoint = matched
+                request = Request(scope, receive)
+                response = await handle(request, handler, params, endpoint)
+                await response(scope, receive, send)
+                return
+
+        await wsgi(scope, receive, send)
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                for db in [database] + replicas:
+                    await db.connect()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for db in [database] + replicas:
+                    await db.disconnect()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    app.database = database
+    app.flask_app = flask_app
+    return app
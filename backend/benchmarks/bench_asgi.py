@@ -0,0 +1,80 @@
+"""Threaded WSGI server against the ASGI app under many concurrent clients.
+
+Runs the load test scenarios of the async-native routes against the
+threaded werkzeug server and against the ASGI app served by uvicorn, for
+each number of concurrent clients.
+
+Usage (from the backend directory, with requirements-asgi.txt installed):
+
+    python benchmarks/bench_asgi.py --questions 100000 --requests 2000 \\
+        --clients 16 --clients 128 --clients 512
+
+The database is TRIVIA_BENCH_DATABASE_URL or a temporary SQLite file; its
+tables are dropped and re-created.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from common import bench_database_url
+from load import run_scenario, serve_in_process
+
+import uvicorn
+
+from asgi import create_asgi_app
+
+ASYNC_SCENARIOS = ("questions", "questions_cursor", "category_questions",
+                   "quizzes")
+
+
+def serve_asgi(database_url):
+    app = create_asgi_app(database_path=database_url)
+    config = uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="on",
+                            log_level="error", backlog=4096)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve()),
+                              daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--clients", type=int, action="append",
+                        help="concurrent clients, 16, 128 and 512 by default")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per scenario")
+    args = parser.parse_args()
+    client_counts = args.clients or [16, 128, 512]
+
+    database_url = bench_database_url()
+    wsgi_server, wsgi_url = serve_in_process(
+        database_url, args.questions, args.categories)
+    asgi_server, asgi_thread, asgi_url = serve_asgi(database_url)
+
+    print(f"{'scenario':<20} {'server':<6} {'clients':>7} {'errors':>6} "
+          f"{'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for name in ASYNC_SCENARIOS:
+            for clients in client_counts:
+                args.clients = clients
+                for server, base_url in (("wsgi", wsgi_url),
+                                         ("asgi", asgi_url)):
+                    r = run_scenario(name, base_url, args)
+                    print(f"{name:<20} {server:<6} {clients:>7} "
+                          f"{r['errors']:>6} {r['rps']:>9.1f} "
+                          f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    finally:
+        wsgi_server.shutdown()
+        asgi_server.should_exit = True
+        asgi_thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Quiz pick latency vs. question bank size.
+
+Compares the former `NOT IN (...) ORDER BY random() LIMIT 1` query with the
+in-memory QuestionPool followed by a primary key lookup, and the same query
+filtered by difficulty with the AdaptiveSelector picking from its
+(category, difficulty) buckets.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_quiz_pick.py [sizes...]
+
+TRIVIA_BENCH_DATABASE_URL selects the database (a temporary SQLite file by
+default). The questions table of that database is dropped and re-created.
+"""
+import random
+import sys
+import time
+
+from common import bench_database_url, percentile, seed
+
+from sqlalchemy import not_, func
+
+from flaskr import create_app
+from flaskr.question_pool import QuestionPool
+from flaskr.selection import AdaptiveSelector
+from models import db, setup_db, Question
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+CATEGORIES = 10
+PREVIOUS_QUESTIONS = 20
+ROUNDS = 200
+
+
+def timed(pick, rounds=ROUNDS):
+    samples = []
+    for _ in range(rounds):
+        category = random.randint(1, CATEGORIES)
+        start = time.perf_counter()
+        pick(category)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return percentile(samples, 0.5) * 1000
+
+
+def order_by_random(previous, difficulty=None):
+    def pick(category):
+        query = Question.query \
+            .filter(Question.category == category) \
+            .filter(not_(Question.id.in_(previous)))
+        if difficulty is not None:
+            query = query.filter(Question.difficulty == difficulty)
+        return query.order_by(func.random()).first()
+    return pick
+
+
+def pooled(pool, previous):
+    seen = set(previous)
+
+    def pick(category):
+        return Question.query.get(pool.pick(category, seen))
+    return pick
+
+
+def adaptive(pool, previous, difficulty):
+    selector = AdaptiveSelector(pool)
+    seen = set(previous)
+
+    def pick(category):
+        # the category weighted 3 to 1 against the next one
+        weights = {category: 3, category % CATEGORIES + 1: 1}
+        return Question.query.get(selector.pick(weights, seen, difficulty))
+    return pick
+
+
+def main(sizes):
+    database_url = bench_database_url()
+
+    app = create_app()
+    setup_db(app, database_url)
+
+    print(f"{'questions':>10} {'order_by_random ms':>20} {'pool ms':>10} "
+          f"{'by difficulty ms':>18} {'adaptive ms':>12}")
+    with app.app_context():
+        for size in sizes:
+            seed(size, CATEGORIES)
+            previous = random.sample(range(1, size + 1), PREVIOUS_QUESTIONS)
+            pool = QuestionPool()
+            pool.ids()  # load outside of the timed picks
+
+            baseline = timed(order_by_random(previous))
+            candidate = timed(pooled(pool, previous))
+            by_difficulty = timed(order_by_random(previous, difficulty=3))
+            selected = timed(adaptive(pool, previous, difficulty=3))
+            db.session.remove()
+            print(f"{size:>10} {baseline:>20.3f} {candidate:>10.3f} "
+                  f"{by_difficulty:>18.3f} {selected:>12.3f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,90 @@
+"""Serialization cost of a page of questions.
+
+Compares the former ORM query + Question.format() + jsonify() path with the
+column-only query + format_question_row() path of the list endpoints, using
+each available JSON encoder, with and without gzip.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_serialization.py [page sizes...]
+
+TRIVIA_BENCH_DATABASE_URL selects the database (a temporary SQLite file by
+default). The tables of that database are dropped and re-created.
+"""
+import gzip
+import sys
+import time
+
+from common import bench_database_url, percentile, seed
+
+from flask import jsonify
+
+from flaskr import create_app
+from flaskr.serialization import get_json_encoder, orjson
+from models import db, setup_db, question_rows, format_question_row, \
+    Question
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+ROUNDS = 30
+
+
+def timed(serialize, rounds=ROUNDS):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        serialize()
+        samples.append(time.perf_counter() - start)
+        db.session.remove()
+    samples.sort()
+    return percentile(samples, 0.5) * 1000
+
+
+def orm_jsonify(size):
+    def serialize():
+        questions = Question.query.order_by(Question.id).limit(size).all()
+        return jsonify({
+            "questions": [q.format() for q in questions]
+        }).get_data()
+    return serialize
+
+
+def rows_encoder(size, dumps, compress=False):
+    def serialize():
+        rows = question_rows().order_by(Question.id).limit(size)
+        data = dumps({
+            "questions": [format_question_row(row) for row in rows]
+        })
+        if compress:
+            data = gzip.compress(
+                data if isinstance(data, bytes) else data.encode())
+        return data
+    return serialize
+
+
+def main(sizes):
+    app = create_app()
+    setup_db(app, bench_database_url())
+
+    candidates = [("orm+jsonify", orm_jsonify)]
+    encoders = ["json"] + (["orjson"] if orjson is not None else [])
+    for name in encoders:
+        dumps = get_json_encoder(name)
+        candidates.append((
+            f"rows+{name}",
+            lambda size, dumps=dumps: rows_encoder(size, dumps)))
+        candidates.append((
+            f"rows+{name}+gzip",
+            lambda size, dumps=dumps: rows_encoder(size, dumps, True)))
+
+    with app.test_request_context():
+        seed(max(sizes))
+        print(f"{'rows':>8} " + " ".join(f"{name:>18}"
+                                         for name, _ in candidates))
+        for size in sizes:
+            timings = [timed(candidate(size)) for _, candidate in candidates]
+            print(f"{size:>8} " + " ".join(f"{t:>15.3f} ms"
+                                           for t in timings))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,51 @@
+"""Cold start time of a worker.
+
+Times, in fresh interpreters, importing and building the serving app
+(`flaskr.create_app()`) against the tooling app of `manage.py`, which also
+loads Flask-Migrate and Alembic.
+
+Usage (from the backend directory):
+
+    python benchmarks/bench_startup.py [rounds]
+"""
+import os
+import subprocess
+import sys
+
+from common import percentile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROUNDS = 10
+
+STARTUPS = {
+    "serving (flaskr)": "from flaskr import create_app; create_app()",
+    "tooling (manage)": "import manage",
+}
+
+TIMER = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def startup_time(code):
+    # seconds to run `code` in a new interpreter, interpreter start excluded
+    output = subprocess.run(
+        [sys.executable, "-c", TIMER.format(code=code)],
+        cwd=BACKEND, check=True, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    return float(output.split()[-1])
+
+
+def main(rounds):
+    print(f"{'startup':<20} {'p50 ms':>8} {'max ms':>8}")
+    for name, code in STARTUPS.items():
+        samples = sorted(startup_time(code) for _ in range(rounds))
+        print(f"{name:<20} {percentile(samples, 0.5) * 1000:>8.1f} "
+              f"{samples[-1] * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROUNDS)
@@ -0,0 +1,54 @@
+"""Helpers shared by the benchmarks: database selection, synthetic question
+banks and latency statistics."""
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, Question, Category  # noqa: E402
+
+WORDS = (
+    "river", "planet", "painter", "king", "ocean", "novel", "mountain",
+    "composer", "empire", "island", "desert", "athlete", "volcano", "poet",
+    "galaxy", "bridge", "temple", "inventor", "film", "city",
+)
+
+
+def bench_database_url():
+    # TRIVIA_BENCH_DATABASE_URL or a new temporary SQLite file
+    database_url = os.environ.get("TRIVIA_BENCH_DATABASE_URL")
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        database_url = f"sqlite:///{path}"
+    return database_url
+
+
+def synthetic_questions(size, categories, rng=random):
+    for i in range(size):
+        first, second = rng.sample(WORDS, 2)
+        yield {
+            "question": f"Which {first} is linked to the {second} #{i}?",
+            "answer": f"answer {i}",
+            "category": rng.randint(1, categories),
+            "difficulty": rng.randint(1, 5),
+        }
+
+
+def seed(size, categories=10, rng=random):
+    # drops and re-creates the tables, then inserts `size` questions spread
+    # over `categories` categories. Needs an app context
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Category.__table__.insert(), [
+        {"type": f"category{i}"} for i in range(categories)])
+    Question.bulk_insert(synthetic_questions(size, categories, rng))
+    db.session.commit()
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))
+    return sorted_samples[index]
@@ -0,0 +1,183 @@
+"""Load test of the API endpoints.
+
+Seeds a synthetic question bank, then drives every scenario below with
+concurrent HTTP clients and reports requests/sec and latency percentiles.
+
+Usage (from the backend directory):
+
+    python benchmarks/load.py --questions 100000 --categories 50 \\
+        --clients 16 --requests 2000
+
+Without --url the app is served in-process by a threaded werkzeug server
+on the benchmark database (TRIVIA_BENCH_DATABASE_URL or a temporary SQLite
+file). With --url an already running server is load tested instead; pass
+--no-seed to keep the data of its database.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import WORDS, bench_database_url, percentile, seed
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from models import setup_db
+
+SCENARIOS = ("questions", "questions_cursor", "category_questions",
+             "search", "quizzes", "quiz_session", "quiz_batch")
+
+
+class Client:
+    def __init__(self, base_url, questions, categories, rng):
+        self.base_url = base_url
+        self.questions = questions
+        self.categories = categories
+        self.rng = rng
+
+    def request(self, path, body=None):
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.base_url + path, data=data,
+                                         headers=headers)
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def questions_page(self):
+        pages = max(1, min(self.questions // 10, 1000))
+        self.request(f"/questions?page={self.rng.randint(1, pages)}")
+
+    def questions_cursor(self):
+        after_id = self.rng.randint(0, max(0, self.questions - 10))
+        self.request(f"/questions?after_id={after_id}")
+
+    def category_questions(self):
+        category = self.rng.randint(1, self.categories)
+        self.request(f"/categories/{category}/questions")
+
+    def search(self):
+        self.request("/questions", {"searchTerm": self.rng.choice(WORDS)})
+
+    def quizzes(self):
+        previous = self.rng.sample(range(1, self.questions + 1),
+                                   min(20, self.questions))
+        self.request("/quizzes", {
+            "previous_questions": previous,
+            "quiz_category": {
+                "id": self.rng.randint(1, self.categories),
+                "type": "category"
+            }
+        })
+
+    def quiz_session(self):
+        # one session of five questions
+        session = self.request("/quizzes/sessions", {"max_questions": 5})
+        for _ in range(5):
+            self.request(f"/quizzes/sessions/{session['session_id']}/next",
+                         {})
+
+    def quiz_batch(self):
+        # the five questions of a play in one request
+        self.request("/quizzes/batch", {
+            "count": 5,
+            "quiz_category": {
+                "id": self.rng.randint(1, self.categories),
+                "type": "category"
+            }
+        })
+
+
+def run_scenario(name, base_url, args):
+    def one_request(i):
+        client = Client(base_url, args.questions, args.categories,
+                        random.Random(i))
+        action = getattr(client, {
+            "questions": "questions_page",
+        }.get(name, name))
+        start = time.perf_counter()
+        try:
+            action()
+        except (urllib.error.URLError, ValueError):
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    samples = sorted(r for r in results if r is not None)
+    return {
+        "scenario": name,
+        "requests": len(results),
+        "errors": len(results) - len(samples),
+        "rps": len(results) / elapsed,
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def serve_in_process(database_url, seed_size, categories, config=None):
+    app = create_app(config)
+    setup_db(app, database_url)
+    if seed_size is not None:
+        with app.app_context():
+            print(f"Seeding {seed_size} questions...")
+            seed(seed_size, categories)
+
+    # one log line per request would dominate the measurements
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base url of a running server")
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per scenario")
+    parser.add_argument("--no-seed", action="store_true")
+    parser.add_argument("--question-index", action="store_true",
+                        help="serve quizzes from the in-memory index")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenarios to run, all by default")
+    args = parser.parse_args()
+
+    server = None
+    seed_size = None if args.no_seed else args.questions
+    if args.url:
+        base_url = args.url.rstrip("/")
+        if seed_size is not None:
+            print("--url given: seeding skipped, run with --no-seed")
+    else:
+        server, base_url = serve_in_process(
+            bench_database_url(), seed_size, args.categories,
+            {"QUESTION_INDEX": args.question_index})
+
+    print(f"{'scenario':<20} {'requests':>8} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for name in args.scenario or SCENARIOS:
+            r = run_scenario(name, base_url, args)
+            print(f"{r['scenario']:<20} {r['requests']:>8} {r['errors']:>6} "
+                  f"{r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
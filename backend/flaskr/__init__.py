@@ -1,15 +1,86 @@
 import os
+import secrets
 import sys
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from sqlalchemy import not_, func
+import time
+import functools
+import base64
+import binascii
+import json
+from flask import Flask, Response, request, abort, jsonify, g, \
+    make_response, stream_with_context
 from flask_cors import CORS
-import random
+from itsdangerous import BadSignature, Signer
 
-from models import setup_db, Question, Category, db
+from models import setup_db, pool_config_from_env, pool_metrics, \
+    replica_config_from_env, use_replica, changed_within, \
+    question_rows, format_question_row, Question, db
+from .cache import QuestionCounts, CategoryCache, ResponseCache
+from .question_pool import QuestionPool, sample_unseen
+from .question_index import QuestionIndex
+from .selection import AdaptiveSelector, DIFFICULTIES, target_difficulty
+from .quiz_sessions import InMemoryQuizSessionStore
+from .search import QuestionSearch
+from .export import export_query, chunked, ndjson_lines, csv_lines
+from .metrics import Metrics, install_query_hooks
+from .profiler import QueryProfile
+from .admission import AdmissionControl, retry_after
+from .serialization import get_json_encoder, json_response, compress_response
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+# seconds a cached question count may lag behind writes of other workers
+QUESTION_COUNT_TTL = 60
+
+# seconds categories are cached in-process and by clients
+CATEGORY_CACHE_TTL = 300
+CATEGORY_CACHE_MAX_AGE = 60
+
+# seconds the in-memory quiz id pool may lag behind other workers
+QUESTION_POOL_TTL = 60
+
+# seconds an idle quiz session is kept
+QUIZ_SESSION_TTL = 3600
+# questions queued by a quiz session, by default and at most
+QUIZ_SESSION_QUESTIONS = 50
+
+# ids accepted by one bulk delete or update
+MAX_BULK_QUESTION_IDS = 1000
+
+# admission control: (running requests, queued requests, seconds a request
+# may wait in the queue) by route class
+CONCURRENCY_LIMITS = {
+    "search": (8, 16, 0.5),
+    "write": (8, 16, 0.5),
+    "quiz": (32, 64, 0.5),
+}
+
+# route class of the limited endpoints. POST /questions is a search or a
+# write depending on its body
+ROUTE_CLASSES = {
+    "bulk_create_questions": "write",
+    "delete_question": "write",
+    "bulk_delete_questions": "write",
+    "update_question": "write",
+    "bulk_update_questions": "write",
+    "quizzes": "quiz",
+    "quizzes_batch": "quiz",
+    "adaptive_quiz": "quiz",
+    "create_quiz_session": "quiz",
+    "next_quiz_question": "quiz",
+}
+
+# questions returned by POST /quizzes/batch
+QUIZ_BATCH_SIZE = 5
+MAX_QUIZ_BATCH_SIZE = 50
+
+# seconds a client reads from the primary after its last write, longer
+# than the replication lag of the read replicas
+REPLICA_LAG = 5
+LAST_WRITE_COOKIE = "trivia_last_write"
+# key signing LAST_WRITE_COOKIE, the same for every worker. Each process
+# makes up its own when unset, so the cookie only counts on its worker
+TRIVIA_SECRET_KEY = os.environ.get("TRIVIA_SECRET_KEY")
 
 TRIVIA_FRONTEND_ORIGIN = os.environ.get(
     "FRONTEND_ORIGIN", "http://localhost:3000")
@@ -17,9 +88,153 @@ TRIVIA_FRONTEND_ORIGIN = os.environ.get(
 # helpers
 
 
-def get_dict_from_categories(categories):
-    # https://stackoverflow.com/a/1993848
-    return dict(((c.id, c.type) for c in categories))
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode(str(question_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, binascii.Error):
+        return None
+
+
+def int_arg(args, name, default=None):
+    # request.args.get(name, default, type=int) for any mapping of args
+    try:
+        return int(args[name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def read_page_args(args):
+    # (page, per_page, after_id) of a paginated list request. `after_id`
+    # comes from `cursor` or `after_id` and is None when paging by `page`.
+    # Raises ValueError for an invalid page, page size or cursor
+    page = int_arg(args, 'page', 1)
+    per_page = int_arg(args, 'per_page', QUESTIONS_PER_PAGE)
+    after_id = int_arg(args, 'after_id')
+    cursor = args.get('cursor', None)
+
+    if page < 1:
+        raise ValueError("page")
+
+    if per_page < 1 or per_page > MAX_QUESTIONS_PER_PAGE:
+        raise ValueError("per_page")
+
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+        if after_id is None:
+            raise ValueError("cursor")
+
+    return page, per_page, after_id
+
+
+def split_page(questions, per_page):
+    # questions are fetched with one extra row to know whether there is a
+    # next page; returns the page and the cursor of the next one
+    next_cursor = None
+    if len(questions) > per_page:
+        questions = questions[:per_page]
+        next_cursor = encode_cursor(questions[-1].id)
+    return questions, next_cursor
+
+
+def paginate_questions(query):
+    # Pages either by `page` (OFFSET) or, when `cursor`/`after_id` is given,
+    # by seeking on the primary key so deep pages cost the same as page 1.
+    # Returns the questions of the page and the cursor of the next one.
+    try:
+        page, per_page, after_id = read_page_args(request.args)
+    except ValueError:
+        abort(400)
+
+    query = query.order_by(Question.id)
+    if after_id is not None:
+        query = query.filter(Question.id > after_id)
+    else:
+        query = query.offset((page - 1) * per_page)
+
+    questions = query.limit(per_page + 1).all()
+
+    if after_id is None and page != 1 and not len(questions):
+        abort(404)
+
+    return split_page(questions, per_page)
+
+
+def last_write_signer(secret_key):
+    # signs the time of LAST_WRITE_COOKIE, so that a client cannot keep its
+    # reads off the caches and replicas with a made-up time
+    return Signer(secret_key, salt=LAST_WRITE_COOKIE)
+
+
+def client_wrote_within(cookies, seconds, signer):
+    # whether LAST_WRITE_COOKIE says the client wrote in the last `seconds`
+    value = cookies.get(LAST_WRITE_COOKIE, None)
+    if value is None:
+        return False
+    try:
+        last_write = float(signer.unsign(value))
+    except (BadSignature, ValueError):
+        return False
+    return 0 <= time.time() - last_write < seconds
+
+
+def caches_lag(config):
+    # seconds the in-process caches may lag behind the writes of other
+    # workers. A client that wrote within it reads past them, since its
+    # write may have gone through another worker
+    return max(config["RESPONSE_CACHE_TTL"], config["QUESTION_COUNT_TTL"],
+               config["QUESTION_POOL_TTL"])
+
+
+def wrote_recently(cookies, lag, signer):
+    # whether the client (LAST_WRITE_COOKIE) or this worker wrote within the
+    # replication lag, in which case reads stay on the primary: the client
+    # must see its writes and the in-process caches reload after a write
+    return client_wrote_within(cookies, lag, signer) or changed_within(lag)
+
+
+def question_filter(data):
+    # criteria of the questions selected by the `ids`, `category` and
+    # `difficulty` keys of a bulk delete or update. At least one is
+    # required. Raises ValueError with the name of the invalid key
+    criteria = []
+    if 'ids' in data:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids or \
+                len(ids) > MAX_BULK_QUESTION_IDS or \
+                not all(isinstance(i, int) for i in ids):
+            raise ValueError('ids')
+        criteria.append(Question.id.in_(ids))
+
+    for field in ('category', 'difficulty'):
+        if field in data:
+            if not isinstance(data[field], int):
+                raise ValueError(field)
+            criteria.append(getattr(Question, field) == data[field])
+
+    if not criteria:
+        raise ValueError('ids')
+    return criteria
+
+
+def read_ndjson(stream):
+    # yields the parsed lines of a NDJSON body, a ValueError for invalid ones
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield e
+
+
+def is_text(value):
+    # a non-blank string
+    return isinstance(value, str) and bool(value.strip())
 
 
 def create_custom_bad_request(field):
@@ -30,67 +245,404 @@ def create_custom_bad_request(field):
     }), 400
 
 
+def create_duplicate_conflict(question_id):
+    return jsonify({
+        "error": 409,
+        "success": False,
+        "message": "Duplicate question",
+        "duplicate_of": question_id
+    }), 409
+
+
 # APP
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        SECRET_KEY=TRIVIA_SECRET_KEY,
+        QUESTION_COUNT_TTL=QUESTION_COUNT_TTL,
+        # serve GET /questions totals from planner statistics (PostgreSQL)
+        ESTIMATE_QUESTION_TOTAL=False,
+        CATEGORY_CACHE_TTL=CATEGORY_CACHE_TTL,
+        CATEGORY_CACHE_MAX_AGE=CATEGORY_CACHE_MAX_AGE,
+        QUESTION_POOL_TTL=QUESTION_POOL_TTL,
+        QUIZ_SESSION_TTL=QUIZ_SESSION_TTL,
+        QUIZ_SESSION_QUESTIONS=QUIZ_SESSION_QUESTIONS,
+        # a QuizSessionStore shared by the workers, in-memory when None
+        QUIZ_SESSION_STORE=None,
+        # "sql", "memory" or None to pick by the database dialect
+        SEARCH_BACKEND=None,
+        # encoder of the list endpoints: "json", "orjson" or None to use
+        # orjson when it is installed
+        JSON_BACKEND=None,
+        # gzip JSON responses of at least COMPRESS_MIN_SIZE bytes
+        COMPRESS_RESPONSES=False,
+        COMPRESS_MIN_SIZE=1024,
+        # cache of the GET list responses, invalidated by question and
+        # category writes
+        RESPONSE_CACHE=True,
+        RESPONSE_CACHE_SIZE=1024,
+        RESPONSE_CACHE_TTL=60,
+        # a store shared by the workers, in-memory LRU when None
+        RESPONSE_CACHE_STORE=None,
+        # read replica URLs used by the read-only endpoints
+        DB_REPLICA_URLS=[],
+        DB_REPLICA_LAG=REPLICA_LAG,
+        # record the SQL statements of every request, send their count and
+        # duration in a Server-Timing header and log duplicate and N+1
+        # statements. QUERY_PROFILE_LISTENER is called with the endpoint
+        # and the flaskr.profiler.QueryProfile of each request
+        QUERY_PROFILING=False,
+        QUERY_PROFILE_LISTENER=None,
+        # per client token buckets, {route class: (requests per second,
+        # burst)}; no rate limit when None
+        RATE_LIMITS=None,
+        # a flaskr.admission.TokenBucketStore shared by the workers,
+        # in-memory when None
+        RATE_LIMIT_STORE=None,
+        # function of the request returning the client of the rate limits,
+        # the remote address when None
+        RATE_LIMIT_CLIENT=None,
+        CONCURRENCY_LIMITS=CONCURRENCY_LIMITS,
+        # serve quizzes and category pages from every question held in
+        # memory, loaded before the first request
+        QUESTION_INDEX=False,
+    )
+    app.config.from_mapping(pool_config_from_env())
+    app.config.from_mapping(replica_config_from_env())
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
     setup_db(app)
-    migrate = Migrate(app, db)
+
+    last_write = last_write_signer(
+        app.config["SECRET_KEY"] or secrets.token_hex(32))
+    # shared with the ASGI mode
+    app.extensions['trivia_last_write_signer'] = last_write
+
+    question_counts = QuestionCounts(
+        ttl=app.config["QUESTION_COUNT_TTL"],
+        estimate=app.config["ESTIMATE_QUESTION_TOTAL"])
+    category_cache = CategoryCache(ttl=app.config["CATEGORY_CACHE_TTL"])
+    question_index = None
+    if app.config["QUESTION_INDEX"]:
+        question_index = QuestionIndex(ttl=app.config["QUESTION_POOL_TTL"])
+        question_pool = question_index
+
+        @app.before_first_request
+        def load_question_index():
+            question_index.id_lists()
+    else:
+        question_pool = QuestionPool(ttl=app.config["QUESTION_POOL_TTL"])
+    selector = AdaptiveSelector(question_pool)
+    quiz_sessions = app.config["QUIZ_SESSION_STORE"] or \
+        InMemoryQuizSessionStore(ttl=app.config["QUIZ_SESSION_TTL"])
+    question_search = QuestionSearch(
+        backend=app.config["SEARCH_BACKEND"],
+        ttl=app.config["QUESTION_POOL_TTL"])
+
+    response_cache = None
+    if app.config["RESPONSE_CACHE"]:
+        response_cache = ResponseCache(
+            store=app.config["RESPONSE_CACHE_STORE"],
+            ttl=app.config["RESPONSE_CACHE_TTL"],
+            max_entries=app.config["RESPONSE_CACHE_SIZE"])
+
+    cache_lag = caches_lag(app.config)
+
+    def fresh_reads():
+        return client_wrote_within(request.cookies, cache_lag,
+                                   last_write)
+
+    def cached_response(view):
+        # serves the view from the response cache and answers
+        # If-None-Match with 304 when the ETag still matches
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            def render():
+                return make_response(view(*args, **kwargs))
+
+            if response_cache is None or fresh_reads():
+                response = render()
+            else:
+                response = response_cache.get_or_render(request, render)
+
+            response.add_etag()
+            return response.make_conditional(request)
+        return wrapper
+
+    def read_from_replica():
+        # routes the reads of the request to a replica
+        if not wrote_recently(request.cookies, app.config["DB_REPLICA_LAG"],
+                              last_write):
+            use_replica()
+
+    def read_only(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            read_from_replica()
+            return view(*args, **kwargs)
+        return wrapper
+
+    question_field_checks = {
+        'question': is_text,
+        'answer': is_text,
+        'category': lambda value: category_cache.get(value) is not None,
+        'difficulty': lambda value: bool(value) and value in range(1, 6),
+    }
+
+    def get_invalid_question_field(data, partial=False):
+        # name of the first invalid field of a new question, or of an edit
+        # of some of its fields when `partial`; None if valid
+        if partial:
+            unknown = [f for f in data if f not in question_field_checks]
+            if unknown:
+                return unknown[0]
+
+        for field, is_valid in question_field_checks.items():
+            if partial and field not in data:
+                continue
+            if not is_valid(data.get(field, None)):
+                return field
+
+        return None
+
+    def question_changes(data):
+        # column values of a valid edit
+        changes = {field: data[field] for field in question_field_checks
+                   if field in data}
+        if 'category' in changes:
+            changes['category'] = int(changes['category'])
+        return changes
+
+    app.extensions['trivia_json_encoder'] = get_json_encoder(
+        app.config["JSON_BACKEND"])
+
+    metrics = Metrics()
+    install_query_hooks()
+
+    admission = AdmissionControl(
+        rate_limits=app.config["RATE_LIMITS"],
+        concurrency=app.config["CONCURRENCY_LIMITS"],
+        store=app.config["RATE_LIMIT_STORE"])
+
+    # shared with the async routes of the ASGI mode
+    app.extensions['trivia_metrics'] = metrics
+    app.extensions['trivia_admission'] = admission
+
+    def get_route_class():
+        if request.endpoint == 'create_question':
+            data = request.get_json(silent=True)
+            if isinstance(data, dict) and data.get('searchTerm', None):
+                return "search"
+            return "write"
+        return ROUTE_CLASSES.get(request.endpoint)
+
+    def too_many_requests(route_class, reason, wait):
+        metrics.count_rejection(route_class, reason)
+        metrics.count_error(429)
+        response = jsonify({
+            "error": 429,
+            "success": False,
+            "message": "Too many requests"
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = retry_after(wait)
+        return response
+
+    def admit():
+        # rejects the request with 429 when its client is over the rate
+        # limit of the route class, or when the class is at its
+        # concurrency limit and its queue is full or does not move
+        route_class = get_route_class()
+        if route_class is None:
+            return None
+
+        client_key = app.config["RATE_LIMIT_CLIENT"]
+        client = client_key(request) if client_key else request.remote_addr
+        wait = admission.rate_limit(route_class, client)
+        if wait:
+            return too_many_requests(route_class, "rate", wait)
+
+        if not admission.enter(route_class):
+            return too_many_requests(route_class, "concurrency", 1)
+        g.route_class = route_class
+        return None
 
     cors = CORS(app, resources={
         "/*": {"origins": TRIVIA_FRONTEND_ORIGIN}
     })
 
+    @app.before_request
+    def before_request():
+        g.request_start = time.perf_counter()
+        # only the commits of this request set LAST_WRITE_COOKIE
+        db.session().info.pop('wrote', None)
+        if app.config["QUERY_PROFILING"]:
+            g.query_profile = QueryProfile()
+        return admit()
+
+    @app.teardown_request
+    def teardown_request(error):
+        route_class = g.pop('route_class', None)
+        if route_class is not None:
+            admission.leave(route_class)
+
+    def report_query_profile(response, profile):
+        response.headers.add('Server-Timing', profile.server_timing())
+
+        endpoint = request.endpoint or "none"
+        duplicates = profile.duplicates()
+        n_plus_one = profile.n_plus_one()
+        if duplicates or n_plus_one:
+            app.logger.warning(
+                "%s %s: %d queries, duplicates %s, N+1 %s",
+                request.method, request.path, profile.count,
+                duplicates, n_plus_one)
+        else:
+            app.logger.debug("%s %s: %d queries in %.2f ms",
+                             request.method, request.path, profile.count,
+                             profile.duration * 1000)
+
+        listener = app.config["QUERY_PROFILE_LISTENER"]
+        if listener is not None:
+            listener(endpoint, profile)
+
     @app.after_request
     def after_request(response):
+        if 'request_start' in g:
+            metrics.observe_request(
+                request.endpoint or "none",
+                request.method,
+                response.status_code,
+                time.perf_counter() - g.request_start,
+                g.get('db_queries', 0),
+                g.get('db_time', 0.0))
+
+        if 'query_profile' in g:
+            report_query_profile(response, g.query_profile)
+
         response.headers.add('Access-Control-Allow-Headers',
                              "Content-Type, Authorization")
         response.headers.add('Access-Control-Allow-Methods',
-                             "GET,POST,PUT,OPTIONS")
+                             "GET,POST,PUT,PATCH,DELETE,OPTIONS")
         response.headers.add('Access-Control-Allow-Credentials',
                              "true")
+
+        if db.session().info.get('wrote'):
+            if response_cache is not None:
+                # right away for the workers sharing the store
+                response_cache.invalidate()
+            response.set_cookie(
+                LAST_WRITE_COOKIE,
+                last_write.sign(str(time.time())).decode(),
+                max_age=max(app.config["DB_REPLICA_LAG"], cache_lag),
+                httponly=True)
+
+        if app.config["COMPRESS_RESPONSES"]:
+            response = compress_response(response, request,
+                                         app.config["COMPRESS_MIN_SIZE"])
         return response
 
     @app.route('/categories')
+    @cached_response
+    @read_only
     def categories():
-        categories = Category.query.all()
-
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "categories": get_dict_from_categories(categories)
+            "categories": category_cache.all()
         })
 
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["CATEGORY_CACHE_MAX_AGE"]
+        return response
+
     @app.route("/questions")
+    @cached_response
+    @read_only
     def get_questions():
-        page = request.args.get('page', 1, type=int)
-        start_question = (page - 1) * QUESTIONS_PER_PAGE
-        end_question = start_question + QUESTIONS_PER_PAGE
+        questions, next_cursor = paginate_questions(question_rows())
 
-        # https://docs.sqlalchemy.org/en/13/orm/query.html#sqlalchemy.orm.query.Query.slice
-        questions = db.session.query(Question).order_by(Question.id).slice(
-            start_question, end_question).all()
-
-        categories = Category.query.all()
-
-        if page != 1 and not len(questions):
-            abort(404)
-        total_questions = Question.query.count()
-        formatted_questions = [q.format() for q in questions]
+        total_questions = question_counts.total(fresh=fresh_reads())
+        formatted_questions = [format_question_row(q) for q in questions]
 
-        return jsonify({
+        return json_response({
             "success": True,
             "questions": formatted_questions,
             "total_questions": total_questions,
-            "categories": get_dict_from_categories(categories),
-            "current_category": None
+            "categories": category_cache.all(),
+            "current_category": None,
+            "next_cursor": next_cursor
         })
 
+    @app.route('/questions/export')
+    @read_only
+    def export_questions():
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return create_custom_bad_request("format")
+
+        # a filter that is given must be an integer: ignoring it would
+        # export every question
+        category = int_arg(request.args, 'category')
+        if 'category' in request.args and category is None:
+            return create_custom_bad_request("category")
+        difficulty = int_arg(request.args, 'difficulty')
+        if 'difficulty' in request.args and difficulty is None:
+            return create_custom_bad_request("difficulty")
+
+        if category is not None and category_cache.get(category) is None:
+            abort(404)
+
+        rows = export_query(db.session, category, difficulty)
+        if export_format == 'csv':
+            lines, mimetype = csv_lines(rows), "text/csv"
+        else:
+            lines, mimetype = ndjson_lines(rows), "application/x-ndjson"
+
+        response = Response(stream_with_context(chunked(lines)),
+                            mimetype=mimetype)
+        response.headers['Content-Disposition'] = \
+            f"attachment; filename=questions.{export_format}"
+        return response
+
     @app.route('/questions/<int:id>', methods=["DELETE"])
     def delete_question(id):
         error = False
-        question = Question.query.get_or_404(id)
+        deleted = 0
+        try:
+            deleted = Question.delete_where(Question.id == id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            error = True
+        finally:
+            db.session.close()
+        if error:
+            abort(422)
+        if not deleted:
+            abort(404)
+
+        return jsonify({
+            "success": True
+        })
+
+    @app.route('/questions', methods=["DELETE"])
+    def bulk_delete_questions():
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return create_custom_bad_request("ids")
+
+        try:
+            criteria = question_filter(data)
+        except ValueError as invalid:
+            return create_custom_bad_request(invalid.args[0])
+
+        error = False
         try:
-            question.delete()
+            deleted = Question.delete_where(*criteria)
+            db.session.commit()
         except Exception:
             db.session.rollback()
             print(sys.exc_info())
@@ -99,11 +651,82 @@ def create_app(test_config=None):
             db.session.close()
         if not error:
             return jsonify({
-                "success": True
+                "success": True,
+                "deleted": deleted
             })
 
         abort(422)
 
+    def update_questions(changes, criteria):
+        # one UPDATE of the questions matching `criteria`, number of
+        # updated questions
+        error = False
+        try:
+            updated = Question.update_where(question_changes(changes),
+                                            *criteria)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            error = True
+        finally:
+            db.session.close()
+        if error:
+            # the new text may be that of another question
+            duplicate_of = 'question' in changes and \
+                Question.duplicate_of(changes['question'])
+            if duplicate_of:
+                abort(make_response(create_duplicate_conflict(duplicate_of)))
+            abort(422)
+        return updated
+
+    @app.route('/questions/<int:id>', methods=["PATCH"])
+    def update_question(id):
+        data = request.get_json()
+        if not isinstance(data, dict) or not data:
+            abort(400)
+
+        invalid_field = get_invalid_question_field(data, partial=True)
+        if invalid_field:
+            return create_custom_bad_request(invalid_field)
+
+        if not update_questions(data, [Question.id == id]):
+            abort(404)
+
+        return jsonify({
+            "success": True
+        })
+
+    @app.route('/questions', methods=["PATCH"])
+    def bulk_update_questions():
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return create_custom_bad_request("set")
+
+        try:
+            criteria = question_filter(data)
+        except ValueError as invalid:
+            return create_custom_bad_request(invalid.args[0])
+
+        changes = data.get('set', None)
+        if not isinstance(changes, dict) or not changes:
+            return create_custom_bad_request("set")
+
+        invalid_field = get_invalid_question_field(changes, partial=True)
+        if invalid_field:
+            return create_custom_bad_request(invalid_field)
+
+        # questions are unique: one text can be set on one question only
+        if 'question' in changes and \
+                db.session.query(Question.id).filter(*criteria) \
+                .limit(2).count() > 1:
+            return create_custom_bad_request("question")
+
+        return jsonify({
+            "success": True,
+            "updated": update_questions(changes, criteria)
+        })
+
     @app.route('/questions', methods=["POST"])
     def create_question():
         error = False
@@ -112,42 +735,42 @@ def create_app(test_config=None):
         search = data.get('searchTerm', None)
 
         if search:
-            questions = Question.query.filter(
-                Question.question.ilike(f"%{search}%")) \
-                .all()
+            if not isinstance(search, str):
+                return create_custom_bad_request("searchTerm")
 
-            formatted_questions = [q.format() for q in questions]
+            page = data.get('page', 1)
+            if not isinstance(page, int) or page < 1:
+                return create_custom_bad_request("page")
 
-            return jsonify({
+            read_from_replica()
+
+            questions, total_questions = question_search.search(
+                search,
+                offset=(page - 1) * QUESTIONS_PER_PAGE,
+                limit=QUESTIONS_PER_PAGE)
+
+            formatted_questions = [format_question_row(q) for q in questions]
+
+            return json_response({
                 "success": True,
                 "questions": formatted_questions,
-                "total_questions": len(questions),
+                "total_questions": total_questions,
                 "current_category": None
             })
 
-        question_input = data.get('question', None)
-        answer_input = data.get('answer', None)
-        category_input = data.get('category', None)
-        difficulty_input = data.get('difficulty', None)
-
-        # Validations
-        if not question_input:
-            return create_custom_bad_request("question")
-
-        if not answer_input:
-            return create_custom_bad_request("answer")
+        invalid_field = get_invalid_question_field(data)
+        if invalid_field:
+            return create_custom_bad_request(invalid_field)
 
-        if not Category.query.get(category_input):
-            return create_custom_bad_request("category")
-
-        if (not difficulty_input) or (difficulty_input not in range(1, 6)):
-            return create_custom_bad_request("difficulty")
+        duplicate_of = Question.duplicate_of(data['question'])
+        if duplicate_of is not None:
+            return create_duplicate_conflict(duplicate_of)
 
         question = Question(
-            question=question_input,
-            answer=answer_input,
-            category=category_input,
-            difficulty=difficulty_input,
+            question=data['question'],
+            answer=data['answer'],
+            category=data['category'],
+            difficulty=data['difficulty'],
         )
 
         try:
@@ -163,59 +786,377 @@ def create_app(test_config=None):
                 "success": True
             })
 
+        # a concurrent insert of the same question won the unique index
+        duplicate_of = Question.duplicate_of(data['question'])
+        if duplicate_of is not None:
+            return create_duplicate_conflict(duplicate_of)
         abort(422)
 
+    @app.route('/questions/bulk', methods=["POST"])
+    def bulk_create_questions():
+        error = False
+        errors = []
+        # index in the request of each row passed to bulk_insert()
+        positions = []
+
+        if request.mimetype == "application/x-ndjson":
+            items = read_ndjson(request.stream)
+        else:
+            items = request.get_json()
+            if not isinstance(items, list):
+                return create_custom_bad_request("questions")
+
+        def valid_rows():
+            # rows to insert, recording why the others were rejected
+            for index, item in enumerate(items):
+                if isinstance(item, ValueError):
+                    errors.append({
+                        "index": index,
+                        "message": "Invalid JSON"
+                    })
+                    continue
+
+                if not isinstance(item, dict):
+                    invalid_field = "question"
+                else:
+                    invalid_field = get_invalid_question_field(item)
+                if invalid_field:
+                    errors.append({
+                        "index": index,
+                        "message": f"Field: {invalid_field} is invalid"
+                    })
+                    continue
+
+                positions.append(index)
+                yield {
+                    "question": item['question'],
+                    "answer": item['answer'],
+                    "category": int(item['category']),
+                    "difficulty": item['difficulty'],
+                }
+
+        def report_duplicate(position, duplicate_of):
+            errors.append({
+                "index": positions[position],
+                "message": "Duplicate question",
+                "duplicate_of": duplicate_of
+            })
+
+        try:
+            inserted = Question.bulk_insert(valid_rows(),
+                                            on_duplicate=report_duplicate)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            error = True
+        finally:
+            db.session.close()
+        if not error:
+            return jsonify({
+                "success": True,
+                "inserted": inserted,
+                "errors": sorted(errors, key=lambda e: e["index"])
+            })
+
+        abort(422)
+
+    def paginate_index(category_id):
+        # paginate_questions() over the question index
+        try:
+            page, per_page, after_id = read_page_args(request.args)
+        except ValueError:
+            abort(400)
+
+        questions = question_index.page(category_id, page, per_page,
+                                        after_id)
+        if after_id is None and page != 1 and not questions:
+            abort(404)
+
+        return split_page(questions, per_page)
+
     @app.route('/categories/<int:category_id>/questions')
+    @cached_response
+    @read_only
     def get_category_questions(category_id):
-        category = Category.query.get_or_404(category_id)
-        questions = Question.query.filter_by(category=category_id).all()
-        formatted_questions = [q.format() for q in questions]
-        return jsonify({
+        if category_cache.get(category_id) is None:
+            abort(404)
+
+        fresh = fresh_reads()
+        if question_index is not None and not fresh:
+            questions, next_cursor = paginate_index(category_id)
+            total_questions = len(question_index.ids(category_id))
+        else:
+            questions, next_cursor = paginate_questions(
+                question_rows().filter(Question.category == category_id))
+            total_questions = question_counts.for_category(category_id,
+                                                           fresh=fresh)
+
+        formatted_questions = [format_question_row(q) for q in questions]
+        return json_response({
             "success": True,
             "questions": formatted_questions,
-            "current_category": category.id,
-            "total_questions": len(formatted_questions)
+            "current_category": category_id,
+            "total_questions": total_questions,
+            "next_cursor": next_cursor
         })
 
+    def get_questions_by_id(question_ids):
+        # rows of the questions of the ids that exist
+        if question_index is not None:
+            return question_index.get_many(question_ids)
+        if not question_ids:
+            return []
+        return question_rows().filter(Question.id.in_(question_ids)).all()
+
+    def get_question(question_id):
+        # formatted question, None if it does not exist
+        rows = get_questions_by_id([question_id])
+        return format_question_row(rows[0]) if rows else None
+
+    def get_quiz_category(data):
+        # id of the requested quiz category, None for all categories.
+        # Aborts with 400 for a body that is not an object or an invalid
+        # quiz_category
+        if data is None:
+            return None
+        if not isinstance(data, dict):
+            abort(400)
+
+        quiz_category = data.get("quiz_category", None)
+        if not quiz_category:
+            return None
+        if not isinstance(quiz_category, dict) or \
+                'type' not in quiz_category:
+            abort(make_response(create_custom_bad_request("quiz_category")))
+        if quiz_category['type'] == "ALL":
+            return None
+
+        category = quiz_category.get('id', None)
+        if category_cache.get(category) is None:
+            abort(404)
+        return int(category)
+
     @app.route('/quizzes', methods=["POST"])
+    @read_only
     def quizzes():
-        category = None
-        quiz_category = None
         previous_questions = []
 
         data = request.get_json()
+        category = get_quiz_category(data)
 
         if data is not None:
-            quiz_category = data.get("quiz_category", None)
             previous_questions = data.get("previous_questions", [])
 
-        need_all_categories = not data or \
-            not quiz_category or \
-            quiz_category['type'] == "ALL"
+        try:
+            seen = set(int(i) for i in previous_questions)
+        except (TypeError, ValueError):
+            return create_custom_bad_request("previous_questions")
 
-        if not need_all_categories:
-            category = Category.query.get_or_404(quiz_category['id'])
+        question = None
+        question_id = question_pool.pick(category, seen)
+        if question_id is not None:
+            question = get_question(question_id)
+            if question is None:
+                # deleted by another worker since the pool was loaded
+                question_pool.invalidate()
+                question_id = question_pool.pick(category, seen)
+                if question_id is not None:
+                    question = get_question(question_id)
 
-        query = Question.query
-        if category:
-            query = query.filter(Question.category == category.id)
+        return jsonify({
+            "success": True,
+            "question":  question
+        })
+
+    @app.route('/quizzes/batch', methods=["POST"])
+    @read_only
+    def quizzes_batch():
+        data = request.get_json()
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            abort(400)
+        category = get_quiz_category(data)
+
+        try:
+            seen = set(int(i) for i in data.get("previous_questions", []))
+        except (TypeError, ValueError):
+            return create_custom_bad_request("previous_questions")
 
-        # from https://stackoverflow.com/a/60815
-        query = query.filter(not_(Question.id.in_(previous_questions))) \
-            .order_by(func.random()).limit(1)
+        count = data.get("count", QUIZ_BATCH_SIZE)
+        if not isinstance(count, int) or \
+                count < 1 or count > MAX_QUIZ_BATCH_SIZE:
+            return create_custom_bad_request("count")
 
-        question = query.first()
+        by_difficulty = data.get("by_difficulty", False)
+        if not isinstance(by_difficulty, bool):
+            return create_custom_bad_request("by_difficulty")
 
-        if question:
-            question = question.format()
+        for _ in range(2):
+            question_ids = question_pool.pick_many(
+                category, seen, count, by_difficulty)
+            rows = get_questions_by_id(question_ids)
+            if len(rows) == len(question_ids):
+                break
+            # some were deleted by another worker since the pool was loaded
+            question_pool.invalidate()
+
+        # in the order of the pick, easiest first when by difficulty
+        questions = {row.id: format_question_row(row) for row in rows}
+        return json_response({
+            "success": True,
+            "questions": [questions[i] for i in question_ids
+                          if i in questions]
+        })
+
+    def get_category_weights(data):
+        # {category id: weight} of an adaptive quiz, None for all
+        # categories. `categories` is a list of ids (even weights) or an
+        # object of weights by id. Raises ValueError when invalid
+        categories = data.get("categories", None)
+        if categories is None:
+            return None
+        if isinstance(categories, list):
+            categories = {category: 1 for category in categories}
+        if not isinstance(categories, dict) or not categories:
+            raise ValueError("categories")
+
+        weights = {}
+        for category, weight in categories.items():
+            if isinstance(weight, bool) or \
+                    not isinstance(weight, (int, float)) or weight <= 0:
+                raise ValueError("categories")
+            if category_cache.get(category) is None:
+                abort(404)
+            weights[int(category)] = weight
+        return weights
+
+    @app.route('/quizzes/adaptive', methods=["POST"])
+    @read_only
+    def adaptive_quiz():
+        data = request.get_json()
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            abort(400)
+
+        try:
+            weights = get_category_weights(data)
+        except (TypeError, ValueError):
+            return create_custom_bad_request("categories")
+
+        try:
+            seen = set(int(i) for i in data.get("previous_questions", []))
+        except (TypeError, ValueError):
+            return create_custom_bad_request("previous_questions")
+
+        answers = data.get("answers", [])
+        if not isinstance(answers, list) or \
+                not all(isinstance(a, bool) for a in answers):
+            return create_custom_bad_request("answers")
+
+        start = data.get("difficulty", DIFFICULTIES[0])
+        if isinstance(start, bool) or start not in DIFFICULTIES:
+            return create_custom_bad_request("difficulty")
+
+        difficulty = target_difficulty(answers, start)
+        question = None
+        for _ in range(2):
+            question_id = selector.pick(weights, seen, difficulty)
+            if question_id is None:
+                break
+            question = get_question(question_id)
+            if question is not None:
+                break
+            # deleted by another worker since the pool was loaded
+            question_pool.invalidate()
 
         return jsonify({
             "success": True,
-            "question":  question
+            "question": question,
+            "difficulty": difficulty
+        })
+
+    @app.route('/quizzes/sessions', methods=["POST"])
+    @read_only
+    def create_quiz_session():
+        data = request.get_json()
+        category = get_quiz_category(data)
+
+        limit = app.config["QUIZ_SESSION_QUESTIONS"]
+        max_questions = limit
+        if data is not None:
+            max_questions = data.get("max_questions", limit)
+        if not isinstance(max_questions, int) or \
+                max_questions < 1 or max_questions > limit:
+            return create_custom_bad_request("max_questions")
+
+        # a random sample in play order, not a shuffle of the whole pool
+        question_ids = sample_unseen(question_pool.ids(category), (),
+                                     max_questions)
+
+        return jsonify({
+            "success": True,
+            "session_id": quiz_sessions.create(question_ids),
+            "total_questions": len(question_ids)
         })
 
+    @app.route('/quizzes/sessions/<session_id>/next', methods=["POST"])
+    @read_only
+    def next_quiz_question(session_id):
+        question = None
+        try:
+            # skip questions deleted since the session started
+            while question is None:
+                question_id = quiz_sessions.next_question_id(session_id)
+                if question_id is None:
+                    break
+                question = get_question(question_id)
+        except KeyError:
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "question": question
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=["DELETE"])
+    def delete_quiz_session(session_id):
+        quiz_sessions.delete(session_id)
+        return jsonify({
+            "success": True
+        })
+
+    @app.route('/metrics')
+    def get_metrics():
+        pool = pool_metrics(db.engine)
+        gauges = {
+            f"trivia_db_pool_{name}": value
+            for name, value in pool.items()
+            if isinstance(value, (int, float))
+        }
+        gauges.update(admission.gauges())
+        return Response(metrics.render(gauges),
+                        mimetype="text/plain; version=0.0.4")
+
+    @app.route('/metrics/pool')
+    def get_pool_metrics():
+        body = {
+            "success": True,
+            "pool": pool_metrics(db.engine)
+        }
+        replicas = app.config["SQLALCHEMY_BINDS"]
+        if replicas:
+            body["replicas"] = {
+                bind: pool_metrics(db.get_engine(app, bind))
+                for bind in replicas
+            }
+        return jsonify(body)
+
     @app.errorhandler(404)
     def not_found(error):
+        metrics.count_error(404)
         print(404)
         return jsonify({
             "error": 404,
@@ -225,6 +1166,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(422)
     def unprocessable(error):
+        metrics.count_error(422)
         return jsonify({
             "error": 422,
             "success": False,
@@ -233,6 +1175,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
+        metrics.count_error(400)
         return jsonify({
             "error": 400,
             "success": False,
@@ -241,6 +1184,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(500)
     def bad_request(error):
+        metrics.count_error(500)
         return jsonify({
             "error": 500,
             "success": False,
@@ -249,6 +1193,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(405)
     def not_allowed_method(error):
+        metrics.count_error(405)
         return jsonify({
             "error": 405,
             "success": False,
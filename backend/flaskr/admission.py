@@ -0,0 +1,130 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketStore:
+    # Token buckets of the rate limiter, one per client and route class.
+    # Subclasses back it with something shared by every worker (e.g. a
+    # Redis script); InMemoryTokenBucketStore is used by default.
+
+    def take(self, key, rate, burst):
+        # takes a token from the bucket of `key`, refilled at `rate` tokens
+        # per second up to `burst`. Returns 0 when a token was taken, else
+        # the seconds until the next one
+        raise NotImplementedError
+
+
+class InMemoryTokenBucketStore(TokenBucketStore):
+    # Buckets of this process. The least recently used bucket is dropped
+    # once there are more than `max_keys`: a dropped bucket is full again.
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class ConcurrencyLimit:
+    # At most `limit` requests of a route class run at once. Up to
+    # `max_queued` more wait, for at most `timeout` seconds, for one of
+    # them to finish; the others are rejected right away.
+
+    def __init__(self, limit, max_queued=0, timeout=0):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+
+    def acquire(self):
+        # True when the request may run, then release() must follow
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            if self.queued >= self.max_queued:
+                return False
+
+            self.queued += 1
+            try:
+                admitted = self._condition.wait_for(
+                    lambda: self.in_flight < self.limit, self.timeout)
+            finally:
+                self.queued -= 1
+            if admitted:
+                self.in_flight += 1
+            return admitted
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+
+class AdmissionControl:
+    # Per-client rate limits and concurrency limits by route class.
+    # `rate_limits` maps a route class to (tokens per second, burst) and
+    # `concurrency` to (limit, max queued, queue timeout); classes missing
+    # from them are not limited.
+
+    def __init__(self, rate_limits=None, concurrency=None, store=None):
+        self.rate_limits = rate_limits or {}
+        self.store = store or InMemoryTokenBucketStore()
+        self.limits = {
+            route_class: ConcurrencyLimit(*settings)
+            for route_class, settings in (concurrency or {}).items()
+        }
+
+    def rate_limit(self, route_class, client):
+        # seconds the client has to wait, 0 when it may go on
+        if route_class not in self.rate_limits:
+            return 0
+        rate, burst = self.rate_limits[route_class]
+        return self.store.take(f"{route_class}:{client}", rate, burst)
+
+    def enter(self, route_class):
+        # whether a request of the class may run now or after queueing.
+        # Each admitted request must leave()
+        limit = self.limits.get(route_class)
+        return limit is None or limit.acquire()
+
+    def leave(self, route_class):
+        limit = self.limits.get(route_class)
+        if limit is not None:
+            limit.release()
+
+    def gauges(self):
+        # queue depth metrics by route class
+        gauges = {}
+        for route_class, limit in sorted(self.limits.items()):
+            labels = f'{{route_class="{route_class}"}}'
+            gauges[f"trivia_admission_in_flight{labels}"] = limit.in_flight
+            gauges[f"trivia_admission_queued{labels}"] = limit.queued
+        return gauges
+
+
+def retry_after(seconds):
+    # value of a Retry-After header: whole seconds, at least 1
+    return str(max(1, math.ceil(seconds)))
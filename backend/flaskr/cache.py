@@ -0,0 +1,227 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Question, Category, questions_version, \
+    categories_version
+
+
+class VersionedCache:
+    # Holds the value returned by `load` and reloads it when `version` moves
+    # (a write in this process) or once it is older than `ttl` seconds
+    # (writes from other workers). A ttl of None never expires by time.
+
+    def __init__(self, load, version, ttl=60):
+        self.load = load
+        self.version = version
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def get(self):
+        entry = self._entry
+        if entry is None or self._is_stale(entry, time.monotonic()):
+            # one thread reloads while the others wait for its result
+            with self._lock:
+                entry = self._entry
+                now = time.monotonic()
+                if entry is None or self._is_stale(entry, now):
+                    # read the version before loading so a write racing
+                    # with the load leaves the entry stale instead of
+                    # hiding the change
+                    version = self.version.value
+                    entry = (self.load(), version, now)
+                    self._entry = entry
+        return entry[0]
+
+    def invalidate(self):
+        self._entry = None
+
+    def _is_stale(self, entry, now):
+        _, version, loaded_at = entry
+        if version != self.version.value:
+            return True
+        return self.ttl is not None and now - loaded_at > self.ttl
+
+
+class QuestionCounts:
+    # Question totals, overall and per category, from a single GROUP BY
+    # query shared by every request until the questions change.
+    # With `estimate` the overall total comes from the PostgreSQL planner
+    # statistics instead, which costs a catalog lookup rather than a scan.
+    # `fresh` counts bypass both, for clients that must see their writes.
+
+    def __init__(self, ttl=60, estimate=False):
+        self.estimate = estimate
+        self._counts = VersionedCache(self._load_counts, questions_version,
+                                      ttl)
+        self._estimate = VersionedCache(self._load_estimate,
+                                        questions_version, ttl)
+
+    def total(self, fresh=False):
+        if fresh:
+            return db.session.query(func.count(Question.id)).scalar()
+        if self.estimate:
+            estimate = self._estimate.get()
+            if estimate is not None:
+                return estimate
+        return sum(self._counts.get().values())
+
+    def for_category(self, category_id, fresh=False):
+        if fresh:
+            return db.session.query(func.count(Question.id)) \
+                .filter(Question.category == category_id).scalar()
+        return self._counts.get().get(category_id, 0)
+
+    def invalidate(self):
+        self._counts.invalidate()
+        self._estimate.invalidate()
+
+    def _load_counts(self):
+        rows = db.session.query(Question.category, func.count(Question.id)) \
+            .group_by(Question.category) \
+            .all()
+        return dict(rows)
+
+    def _load_estimate(self):
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        estimate = db.session.execute(
+            "SELECT reltuples::bigint FROM pg_class "
+            "WHERE relname = :table", {"table": Question.__tablename__}
+        ).scalar()
+        # reltuples is -1 (or 0) until the table is first analyzed
+        if estimate is None or estimate <= 0:
+            return None
+        return estimate
+
+
+class CategoryCache:
+    # Category types by id. Categories almost never change, so they are
+    # loaded once and kept until a category is written or `ttl` passes.
+
+    def __init__(self, ttl=300):
+        self._categories = VersionedCache(self._load, categories_version, ttl)
+
+    def all(self):
+        return self._categories.get()
+
+    def get(self, category_id):
+        # ids may come in as strings from JSON bodies and html forms
+        try:
+            return self.all().get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def invalidate(self):
+        self._categories.invalidate()
+
+    def _load(self):
+        rows = db.session.query(Category.id, Category.type) \
+            .order_by(Category.id) \
+            .all()
+        return dict(rows)
+
+
+class LRUStore:
+    # In-process store of at most `max_entries` values, dropping the least
+    # recently used one first.
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResponseCache:
+    # Successful GET responses keyed on path and query string and on the
+    # generation of the store. The generation is a token kept in the store
+    # itself and replaced on every question or category write, so that a
+    # store shared by the workers (the get/set methods of LRUStore, e.g.
+    # over Redis) stops serving the entries of every worker at once.
+    # Writes are noticed through the version counters of this process, or
+    # invalidate(); entries expire after `ttl` seconds for the others.
+
+    GENERATION_KEY = "generation"
+
+    def __init__(self, store=None, ttl=60, max_entries=1024):
+        self.store = store if store is not None else LRUStore(max_entries)
+        self.ttl = ttl
+        self._versions = None
+
+    def get_or_render(self, request, render):
+        # `render` returns the response of the view on a cache miss.
+        # The generation is read before rendering, so that a write during
+        # the render leaves the entry under an old generation
+        key = f"{self._generation()}:{self.key(request)}"
+
+        frozen = self.store.get(key)
+        if frozen is not None:
+            body, status, headers = frozen
+            return current_app.response_class(body, status=status,
+                                              headers=headers)
+
+        response = render()
+        if response.status_code == 200 and not response.is_streamed:
+            response.add_etag()
+            frozen = (response.get_data(), response.status_code,
+                      list(response.headers))
+            self.store.set(key, frozen, self.ttl)
+        return response
+
+    def key(self, request):
+        args = sorted(request.args.items(multi=True))
+        return request.path + '?' + urlencode(args)
+
+    def invalidate(self):
+        # a new generation: no worker sharing the store finds the entries
+        # rendered before
+        generation = secrets.token_hex(8)
+        self.store.set(self.GENERATION_KEY, generation)
+        self._versions = self._current_versions()
+        return generation
+
+    def _generation(self):
+        versions = self._current_versions()
+        if self._versions is None:
+            self._versions = versions
+        elif versions != self._versions:
+            # written by this process
+            return self.invalidate()
+
+        generation = self.store.get(self.GENERATION_KEY)
+        if generation is None:
+            generation = self.invalidate()
+        return generation
+
+    def _current_versions(self):
+        return (questions_version.value, categories_version.value)
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+
+from models import Question, QUESTION_FIELDS, question_rows, \
+    format_question_row
+
+# rows fetched from the database cursor and written per chunk
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_query(session, category=None, difficulty=None):
+    # column-only query read through a server-side cursor (PostgreSQL) in
+    # batches, so memory stays constant whatever the size of the table
+    query = question_rows(session)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query.order_by(Question.id) \
+        .execution_options(stream_results=True) \
+        .yield_per(EXPORT_BATCH_SIZE)
+
+
+def chunked(lines, size=EXPORT_BATCH_SIZE):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(format_question_row(row)) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(QUESTION_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # the header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
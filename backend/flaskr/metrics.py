@@ -0,0 +1,179 @@
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    labels = ",".join(f'{name}="{value}"' for name, value in pairs)
+    return "{" + labels + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., count, sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = [0] * (len(self.buckets) + 2)
+                self._values[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = format_labels(self.labels, label_values,
+                                           [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.labels, label_values,
+                                       [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-2]}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+                lines.append(f"{self.name}_count{labels} {series[-2]}")
+        return lines
+
+
+class Metrics:
+    # Request, database and error metrics of one app, rendered in the
+    # Prometheus text format. Values are per process: every worker is
+    # scraped on its own.
+
+    def __init__(self):
+        self.request_duration = Histogram(
+            "trivia_request_duration_seconds",
+            "Request latency by endpoint",
+            labels=("endpoint", "method"))
+        self.requests = Counter(
+            "trivia_requests_total",
+            "Requests by endpoint and status",
+            labels=("endpoint", "method", "status"))
+        self.db_queries = Histogram(
+            "trivia_request_db_queries",
+            "SQL statements run per request",
+            labels=("endpoint",), buckets=QUERY_COUNT_BUCKETS)
+        self.db_duration = Histogram(
+            "trivia_request_db_seconds",
+            "Time spent in SQL statements per request",
+            labels=("endpoint",))
+        self.errors = Counter(
+            "trivia_errors_total",
+            "Responses of the error handlers",
+            labels=("status",))
+        self.rejections = Counter(
+            "trivia_admission_rejected_total",
+            "Requests rejected with 429 by route class and reason",
+            labels=("route_class", "reason"))
+
+    def observe_request(self, endpoint, method, status, duration,
+                        queries, db_duration):
+        self.request_duration.observe(duration, endpoint, method)
+        self.requests.inc(endpoint, method, str(status))
+        self.db_queries.observe(queries, endpoint)
+        self.db_duration.observe(db_duration, endpoint)
+
+    def count_error(self, status):
+        self.errors.inc(str(status))
+
+    def count_rejection(self, route_class, reason):
+        self.rejections.inc(route_class, reason)
+
+    def render(self, gauges=None):
+        # `gauges` maps extra gauge names, labels included, to their
+        # current value
+        lines = []
+        for metric in (self.request_duration, self.requests,
+                       self.db_queries, self.db_duration, self.errors,
+                       self.rejections):
+            lines.extend(metric.render())
+        typed = set()
+        for name, value in (gauges or {}).items():
+            metric_name = name.split("{")[0]
+            if metric_name not in typed:
+                typed.add(metric_name)
+                lines.append(f"# TYPE {metric_name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# query hooks
+#     count the SQL statements of the current request and their duration
+#     in `g.db_queries` and `g.db_time`, for every engine, and record them
+#     in `g.query_profile` when the request is profiled
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + duration
+        profile = g.get('query_profile')
+        if profile is not None:
+            profile.record(statement, parameters, duration)
+
+
+def handle_error(context):
+    # failed statements never reach after_cursor_execute
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def install_query_hooks():
+    if not event.contains(Engine, "before_cursor_execute",
+                          before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
@@ -0,0 +1,75 @@
+import re
+from collections import Counter
+
+# executions of one statement shape, with different parameters, flagged
+# as a likely N+1 pattern (one query per row of a previous query)
+N_PLUS_ONE_THRESHOLD = 3
+
+SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+SQL_PARAMETER = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+SQL_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SQL_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement):
+    # shape of a statement: literals and parameters of any paramstyle
+    # become ?, IN lists of any length one (?) and whitespace one space
+    sql = SQL_STRING.sub("?", statement)
+    sql = SQL_PARAMETER.sub("?", sql)
+    sql = SQL_NUMBER.sub("?", sql)
+    sql = SQL_VALUE_LIST.sub("(?)", sql)
+    return SQL_SPACE.sub(" ", sql).strip()
+
+
+class QueryProfile:
+    # SQL statements of one request, recorded by the query hooks of
+    # flaskr.metrics while it is set as `g.query_profile`
+
+    def __init__(self):
+        # (normalized sql, statement, parameters, duration)
+        self.statements = []
+
+    def record(self, statement, parameters, duration):
+        self.statements.append(
+            (normalize_sql(statement), statement, repr(parameters),
+             duration))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(s[3] for s in self.statements)
+
+    def duplicates(self):
+        # {statement: executions} of statements run more than once with
+        # the same parameters
+        counts = Counter((s[1], s[2]) for s in self.statements)
+        return {statement: n for (statement, _), n in counts.items()
+                if n > 1}
+
+    def n_plus_one(self, threshold=N_PLUS_ONE_THRESHOLD):
+        # {normalized sql: executions} of statement shapes run at least
+        # `threshold` times with different parameters
+        shapes = {}
+        for normalized, _, parameters, _ in self.statements:
+            shapes.setdefault(normalized, set()).add(parameters)
+        return {normalized: len(parameters)
+                for normalized, parameters in shapes.items()
+                if len(parameters) >= threshold}
+
+    def summary(self):
+        by_shape = Counter(s[0] for s in self.statements)
+        return {
+            "queries": self.count,
+            "duration": self.duration,
+            "statements": dict(by_shape),
+            "duplicates": self.duplicates(),
+            "n_plus_one": self.n_plus_one(),
+        }
+
+    def server_timing(self):
+        # value of a Server-Timing header, durations in milliseconds
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries"'
@@ -0,0 +1,78 @@
+from array import array
+from bisect import bisect_right
+
+from models import question_rows, Question, QuestionRow
+from .question_pool import QuestionPool, index_ids
+
+
+class QuestionRecords:
+    # Questions stored by slot: one array or list per column and a dict
+    # from id to slot, instead of one object per question.
+
+    def __init__(self):
+        self.slots = {}
+        self.ids = array('l')
+        self.categories = array('l')
+        self.difficulties = array('l')
+        self.questions = []
+        self.answers = []
+
+    def add(self, question_id, question, answer, category, difficulty):
+        self.slots[question_id] = len(self.ids)
+        self.ids.append(question_id)
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.categories.append(category)
+        self.difficulties.append(difficulty)
+
+    def get(self, question_id):
+        # QuestionRow of the id, None if there is no such question
+        slot = self.slots.get(question_id)
+        if slot is None:
+            return None
+        return QuestionRow(self.ids[slot], self.questions[slot],
+                           self.answers[slot], self.categories[slot],
+                           self.difficulties[slot])
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class QuestionIndex(QuestionPool):
+    # Every question held in memory: the id lists of QuestionPool plus the
+    # question records, loaded with one query and reloaded when a commit
+    # of this process changes the questions table, or after `ttl` seconds
+    # for the writes of other workers. Quiz picks and category pages are
+    # then served without a database round-trip.
+
+    def id_lists(self):
+        return self._ids.get()[0]
+
+    def records(self):
+        return self._ids.get()[1]
+
+    def get(self, question_id):
+        return self.records().get(question_id)
+
+    def get_many(self, question_ids):
+        records = self.records()
+        rows = (records.get(i) for i in question_ids)
+        return [row for row in rows if row is not None]
+
+    def page(self, category, page, per_page, after_id=None):
+        # rows of a page of the category ordered by id, with one extra row
+        # when there is a next page, as paginate_questions() fetches them
+        ids = self.ids(category)
+        if after_id is not None:
+            start = bisect_right(ids, after_id)
+        else:
+            start = (page - 1) * per_page
+        return self.get_many(ids[start:start + per_page + 1])
+
+    def _load(self):
+        records = QuestionRecords()
+        for row in question_rows().order_by(Question.id):
+            records.add(*row)
+        id_lists = index_ids(zip(records.ids, records.categories,
+                                 records.difficulties))
+        return id_lists, records
@@ -0,0 +1,136 @@
+import random
+from array import array
+from collections import defaultdict
+
+from models import db, Question, questions_version
+from .cache import VersionedCache
+
+# random draws tried before falling back to scanning the remaining ids
+PICK_ATTEMPTS = 8
+
+
+def pick_unseen(ids, seen, rng=random, attempts=PICK_ATTEMPTS):
+    # Random probing finds an unseen id in a few O(1) draws while most of
+    # the pool is unseen. Once the seen ids crowd the pool the remaining
+    # ones are collected, which is bounded by the size of one quiz.
+    if not ids:
+        return None
+    for _ in range(attempts):
+        candidate = ids[rng.randrange(len(ids))]
+        if candidate not in seen:
+            return candidate
+
+    remaining = [i for i in ids if i not in seen]
+    if not remaining:
+        return None
+    return rng.choice(remaining)
+
+
+def sample_unseen(ids, seen, count, rng=random, attempts=PICK_ATTEMPTS):
+    # up to `count` distinct random ids not in `seen`, probing like
+    # pick_unseen() and scanning the pool once when probes keep missing
+    picked = []
+    taken = set(seen)
+    misses = 0
+    while ids and len(picked) < count and misses < attempts:
+        candidate = ids[rng.randrange(len(ids))]
+        if candidate in taken:
+            misses += 1
+            continue
+        picked.append(candidate)
+        taken.add(candidate)
+
+    if len(picked) < count:
+        remaining = [i for i in ids if i not in taken]
+        picked += rng.sample(remaining,
+                             min(count - len(picked), len(remaining)))
+    return picked
+
+
+def stratify(buckets, count):
+    # up to `count` ids taken in turn from each bucket of `buckets`, sorted
+    # by bucket key, so every bucket gets an equal share while it has ids
+    # and the others fill in for the short ones
+    buckets = [list(buckets[key]) for key in sorted(buckets)]
+    picked = [[] for _ in buckets]
+    total = 0
+    while total < count and any(buckets):
+        for bucket, taken in zip(buckets, picked):
+            if bucket and total < count:
+                taken.append(bucket.pop())
+                total += 1
+    return [i for taken in picked for i in taken]
+
+
+class QuestionPool:
+    # Question ids, overall, per category and per category and difficulty,
+    # held in memory as compact arrays so a quiz step picks an unseen
+    # question without asking the database to sort the category by
+    # random().
+
+    def __init__(self, ttl=60, rng=random):
+        self.rng = rng
+        self._ids = VersionedCache(self._load, questions_version, ttl)
+
+    def ids(self, category=None):
+        all_ids, by_category, _ = self.id_lists()
+        if category is None:
+            return all_ids
+        return by_category.get(category, array('l'))
+
+    def ids_by_difficulty(self, category=None):
+        # {difficulty: ids} of the category, of all categories when None
+        _, _, by_difficulty = self.id_lists()
+        return {difficulty: ids
+                for (bucket, difficulty), ids in by_difficulty.items()
+                if bucket == category}
+
+    def bucket(self, category, difficulty):
+        # ids of the category, or of all categories when None, with the
+        # difficulty
+        _, _, by_difficulty = self.id_lists()
+        return by_difficulty.get((category, difficulty), array('l'))
+
+    def pick(self, category=None, seen=()):
+        return pick_unseen(self.ids(category), seen, self.rng)
+
+    def pick_many(self, category=None, seen=(), count=1,
+                  by_difficulty=False):
+        # up to `count` distinct unseen ids. With `by_difficulty` they are
+        # spread evenly over the difficulties and ordered easiest first
+        if not by_difficulty:
+            return sample_unseen(self.ids(category), seen, count, self.rng)
+
+        buckets = {
+            difficulty: sample_unseen(ids, seen, count, self.rng)
+            for difficulty, ids in self.ids_by_difficulty(category).items()
+        }
+        return stratify(buckets, count)
+
+    def id_lists(self):
+        # (all ids, ids by category, ids by (category, difficulty))
+        return self._ids.get()
+
+    def invalidate(self):
+        self._ids.invalidate()
+
+    def _load(self):
+        rows = db.session.query(
+            Question.id, Question.category, Question.difficulty) \
+            .order_by(Question.id)
+        return index_ids(rows)
+
+
+def index_ids(rows):
+    # (all ids, ids by category, ids by (category, difficulty)) of
+    # (id, category, difficulty) rows. The last one also has the ids of
+    # all categories by difficulty, under (None, difficulty)
+    all_ids = array('l')
+    by_category = defaultdict(lambda: array('l'))
+    by_difficulty = defaultdict(lambda: array('l'))
+    for question_id, category, difficulty in rows:
+        all_ids.append(question_id)
+        by_category[category].append(question_id)
+        by_difficulty[category, difficulty].append(question_id)
+        by_difficulty[None, difficulty].append(question_id)
+    return all_ids, dict(by_category), dict(by_difficulty)
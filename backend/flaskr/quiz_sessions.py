@@ -0,0 +1,71 @@
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class QuizSessionStore:
+    # Keeps the shuffled ids that a quiz session has not played yet.
+    # Subclasses back it with something shared by every worker (e.g. a
+    # Redis list); InMemoryQuizSessionStore is used by default.
+
+    def create(self, question_ids):
+        # stores the ids in play order and returns a new session id
+        raise NotImplementedError
+
+    def next_question_id(self, session_id):
+        # pops the next id, None once the session is exhausted.
+        # Raises KeyError for unknown or expired sessions
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+class InMemoryQuizSessionStore(QuizSessionStore):
+    # Sessions of this process. A session expires `ttl` seconds after it
+    # was last used, and the least recently used one is dropped once there
+    # are more than `max_sessions`.
+
+    def __init__(self, ttl=3600, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def create(self, question_ids):
+        session_id = secrets.token_urlsafe(16)
+        # stored reversed so that popping from the end keeps the order
+        remaining = array('l', reversed(question_ids))
+        with self._lock:
+            self._sessions[session_id] = (remaining, time.monotonic())
+            self._evict()
+        return session_id
+
+    def next_question_id(self, session_id):
+        with self._lock:
+            remaining, last_used = self._sessions[session_id]
+            now = time.monotonic()
+            if now - last_used > self.ttl:
+                del self._sessions[session_id]
+                raise KeyError(session_id)
+
+            self._sessions[session_id] = (remaining, now)
+            self._sessions.move_to_end(session_id)
+            if not remaining:
+                return None
+            return remaining.pop()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and \
+                    now - last_used <= self.ttl:
+                break
+            del self._sessions[session_id]
@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from models import db, Question, questions_version, question_rows
+from .cache import VersionedCache
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SqlSearch:
+    # Case-insensitive substring search for PostgreSQL. The ILIKE filter is
+    # served by the pg_trgm GIN index of the search migration and matches
+    # are ranked by full-text relevance.
+
+    def search(self, term, offset, limit):
+        query = question_rows().filter(
+            Question.question.ilike(f"%{escape_like(term)}%", escape='\\'))
+        total = query.count()
+
+        rank = func.ts_rank(
+            func.to_tsvector('english', Question.question),
+            func.plainto_tsquery('english', term))
+        questions = query.order_by(rank.desc(), Question.id) \
+            .offset(offset) \
+            .limit(limit) \
+            .all()
+
+        return questions, total
+
+
+class TrigramIndex:
+    # In-memory inverted index from the trigrams of the lowercased question
+    # texts to question ids. Candidates sharing every trigram of the term
+    # are checked for the substring, so a search only looks at questions
+    # that can match.
+
+    def __init__(self, rows):
+        self.texts = {}
+        self.postings = defaultdict(set)
+        for question_id, text in rows:
+            text = text.lower()
+            self.texts[question_id] = text
+            for trigram in trigrams(text):
+                self.postings[trigram].add(question_id)
+
+    def search(self, term):
+        # matching ids, most occurrences first, then earliest occurrence
+        term = term.lower()
+        grams = trigrams(term)
+        if grams:
+            sets = sorted((self.postings.get(g, set()) for g in grams),
+                          key=len)
+            candidates = set.intersection(*sets)
+        else:
+            candidates = self.texts.keys()
+
+        matches = []
+        for question_id in candidates:
+            text = self.texts[question_id]
+            position = text.find(term)
+            if position != -1:
+                matches.append(
+                    (-text.count(term), position, question_id))
+
+        matches.sort()
+        return [question_id for _, _, question_id in matches]
+
+
+class MemorySearch:
+    # Same results as SqlSearch for databases without trigram indexes
+    # (SQLite test runs), using a TrigramIndex rebuilt when questions change.
+
+    def __init__(self, ttl=60):
+        self._index = VersionedCache(self._load, questions_version, ttl)
+
+    def search(self, term, offset, limit):
+        ids = self._index.get().search(term)
+        page_ids = ids[offset:offset + limit]
+        if not page_ids:
+            return [], len(ids)
+
+        by_id = {q.id: q for q in
+                 question_rows().filter(Question.id.in_(page_ids))}
+        questions = [by_id[i] for i in page_ids if i in by_id]
+        return questions, len(ids)
+
+    def _load(self):
+        rows = db.session.query(Question.id, Question.question)
+        return TrigramIndex(rows)
+
+
+class QuestionSearch:
+    # Picks the search backend on first use: `backend` is "sql", "memory"
+    # or None to choose by the database dialect.
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self._search = None
+
+    def search(self, term, offset, limit):
+        if self._search is None:
+            self._search = self._create()
+        return self._search.search(term, offset, limit)
+
+    def _create(self):
+        backend = self.backend
+        if backend is None:
+            dialect = db.engine.dialect.name
+            backend = "sql" if dialect == "postgresql" else "memory"
+
+        if backend == "sql":
+            return SqlSearch()
+        if backend == "memory":
+            return MemorySearch(ttl=self.ttl)
+        raise ValueError(f"Unknown search backend: {backend}")
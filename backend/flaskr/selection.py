@@ -0,0 +1,51 @@
+import random
+
+from .question_pool import pick_unseen
+
+DIFFICULTIES = (1, 2, 3, 4, 5)
+
+# recent answers that move the target difficulty
+RAMP_WINDOW = 5
+
+
+def target_difficulty(answers, start=DIFFICULTIES[0], window=RAMP_WINDOW):
+    # staircase over the last `window` answers: a right answer moves one
+    # difficulty up, a wrong one one down, from `start`
+    level = start
+    for correct in answers[-window:]:
+        level += 1 if correct else -1
+        level = min(max(level, DIFFICULTIES[0]), DIFFICULTIES[-1])
+    return level
+
+
+def nearest_difficulties(target):
+    # every difficulty, the closest to `target` first, easier on ties
+    return sorted(DIFFICULTIES, key=lambda d: (abs(d - target), d))
+
+
+class AdaptiveSelector:
+    # Picks quiz questions from the (category, difficulty) buckets of a
+    # QuestionPool: a category drawn by weight, then the target difficulty
+    # or the nearest one with unseen questions. A pick probes a bounded
+    # number of buckets, whatever the size of the question bank.
+
+    def __init__(self, pool, rng=random):
+        self.pool = pool
+        self.rng = rng
+
+    def pick(self, weights=None, seen=(), difficulty=DIFFICULTIES[0]):
+        # id of an unseen question, None once every bucket is played.
+        # `weights` maps categories to their weight, all categories
+        # evenly when None
+        categories = dict(weights) if weights else {None: 1}
+        while categories:
+            category = self.rng.choices(list(categories),
+                                        list(categories.values()))[0]
+            for level in nearest_difficulties(difficulty):
+                question_id = pick_unseen(
+                    self.pool.bucket(category, level), seen, self.rng)
+                if question_id is not None:
+                    return question_id
+            # the category is played out: draw among the others
+            del categories[category]
+        return None
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+from flask import current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlib_dumps(payload):
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def orjson_dumps(payload):
+    # categories are keyed by integer ids
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+
+def get_json_encoder(name=None):
+    # "json", "orjson", or None for orjson when it is installed
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_BACKEND is orjson but it is not installed")
+        return orjson_dumps
+    if name == "json":
+        return stdlib_dumps
+    raise ValueError(f"Unknown JSON encoder: {name}")
+
+
+def json_response(payload, status=200):
+    # jsonify() for large payloads: encoded by the app's JSON_BACKEND
+    # without pretty printing or sorting keys
+    dumps = current_app.extensions['trivia_json_encoder']
+    return current_app.response_class(dumps(payload), status=status,
+                                      mimetype='application/json')
+
+
+def compress_response(response, request, min_size, level=6):
+    # gzips buffered responses of at least `min_size` bytes for clients
+    # that accept it. Streamed responses are left alone
+    if response.direct_passthrough or response.is_streamed or \
+            response.status_code != 200 or \
+            'Content-Encoding' in response.headers or \
+            'gzip' not in request.accept_encodings:
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=level))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the compressed body is not byte-identical to the original one
+        response.set_etag(etag, weak=True)
+    return response
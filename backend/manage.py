@@ -0,0 +1,39 @@
+import click
+from flask_migrate import Migrate
+
+from flaskr import create_app
+from models import db, deduplicate_questions
+from seed import load_seed_data
+
+# tooling entry point: migrations and seeding, kept out of the serving app
+# so that workers do not import Alembic
+#
+#     FLASK_APP=manage flask db upgrade
+#     FLASK_APP=manage flask seed
+#     FLASK_APP=manage flask dedup
+
+app = create_app()
+migrate = Migrate(app, db)
+
+
+@app.cli.command("seed")
+@click.option("--path", default="seed_data.json", show_default=True,
+              help="JSON file of categories and questions")
+def seed_command(path):
+    """Insert the categories and questions of a seed file."""
+    load_seed_data(path)
+
+
+@app.cli.command("dedup")
+@click.option("--dry-run", is_flag=True,
+              help="Only count the duplicates")
+def dedup_command(dry_run):
+    """Delete duplicate questions and fill in missing question hashes."""
+    deleted, hashed = deduplicate_questions(dry_run=dry_run)
+    db.session.commit()
+    if dry_run:
+        click.echo(f"{deleted} duplicate questions to delete, "
+                   f"{hashed} questions to hash.")
+    else:
+        click.echo(f"Deleted {deleted} duplicate questions, "
+                   f"hashed {hashed} questions.")
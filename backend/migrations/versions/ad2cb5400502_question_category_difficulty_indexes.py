@@ -0,0 +1,32 @@
+"""Category and difficulty indexes on questions.
+
+Revision ID: ad2cb5400502
+Revises: c197545def96
+Create Date: 2026-10-18 11:04:19.850341
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ad2cb5400502'
+down_revision = 'c197545def96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL does not index foreign key columns by itself
+    op.create_index('ix_questions_category_id', 'questions',
+                    ['category', 'id'])
+    op.create_index('ix_questions_category_difficulty', 'questions',
+                    ['category', 'difficulty', 'id'])
+    op.create_index('ix_questions_difficulty_id', 'questions',
+                    ['difficulty', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_questions_difficulty_id', table_name='questions')
+    op.drop_index('ix_questions_category_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -0,0 +1,34 @@
+"""Trigram index for question search.
+
+Revision ID: c197545def96
+Revises: b14370f7e9dd
+Create Date: 2026-10-18 10:12:41.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c197545def96'
+down_revision = 'b14370f7e9dd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # serves the `question ILIKE '%term%'` search of POST /questions,
+    # which a B-tree index cannot. PostgreSQL only: other databases
+    # search with the in-memory index of flaskr.search
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_questions_question_trgm', 'questions', ['question'],
+                    postgresql_using='gin',
+                    postgresql_ops={'question': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_questions_question_trgm', table_name='questions')
@@ -0,0 +1,31 @@
+"""Hash of the normalized question text, for duplicate detection.
+
+Revision ID: e5b7d4a91c36
+Revises: ad2cb5400502
+Create Date: 2026-10-18 14:26:51.203417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7d4a91c36'
+down_revision = 'ad2cb5400502'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NULL for the existing rows: `flask dedup` (manage.py) hashes them
+    # and deletes their duplicates in one pass over the table
+    op.add_column('questions',
+                  sa.Column('question_hash', sa.String(length=40),
+                            nullable=True))
+    op.create_index('ix_questions_question_hash', 'questions',
+                    ['question_hash'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_questions_question_hash', table_name='questions')
+    op.drop_column('questions', 'question_hash')
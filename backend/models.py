@@ -1,6 +1,15 @@
+import hashlib
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import random
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+from sqlalchemy import Column, String, Integer, Index, bindparam, \
+    create_engine, event, select
+from sqlalchemy.orm import sessionmaker, validates
+from sqlalchemy.pool import NullPool, QueuePool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
 import json
 
 from sqlalchemy.sql.schema import ForeignKey
@@ -11,28 +20,256 @@ default_database_path = "postgresql://{}@{}/{}".format(
     database_username, 'localhost:5432', database_name)
 database_path = os.environ.get("TRIVIA_DATABASE_URL", default_database_path)
 
-db = SQLAlchemy()
+# SQLALCHEMY_BINDS keys of the read replicas
+REPLICA_BIND_PREFIX = "replica"
+
+
+# RoutingSession
+#     session that runs the statements of a request marked with
+#     use_replica() on a read replica. Flushes always go to the primary
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+# rows sent per executemany() by Question.bulk_insert
+BULK_INSERT_BATCH_SIZE = 1000
+
+
+# VersionCounter
+#     a number bumped every time a table changes, so in-process caches
+#     can tell whether what they hold is stale
+
+class VersionCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+        # time.monotonic() of the last bump
+        self.changed_at = None
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+            self.changed_at = time.monotonic()
+
+
+table_versions = {
+    'questions': VersionCounter(),
+    'categories': VersionCounter(),
+}
+questions_version = table_versions['questions']
+categories_version = table_versions['categories']
+
+
+def changed_within(seconds):
+    # whether this process committed a change to any table in the last
+    # `seconds` seconds
+    now = time.monotonic()
+    return any(v.changed_at is not None and now - v.changed_at < seconds
+               for v in table_versions.values())
+
+
+def env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+# pool_config_from_env()
+#     connection pool settings of the app config, read from TRIVIA_DB_*
+#     environment variables. None leaves the SQLAlchemy default
+
+def pool_config_from_env():
+    return {
+        "DB_POOL_SIZE": env_int("TRIVIA_DB_POOL_SIZE"),
+        "DB_MAX_OVERFLOW": env_int("TRIVIA_DB_MAX_OVERFLOW"),
+        "DB_POOL_TIMEOUT": env_int("TRIVIA_DB_POOL_TIMEOUT"),
+        "DB_POOL_RECYCLE": env_int("TRIVIA_DB_POOL_RECYCLE"),
+        "DB_POOL_PRE_PING": env_flag("TRIVIA_DB_POOL_PRE_PING"),
+        # milliseconds, PostgreSQL only
+        "DB_STATEMENT_TIMEOUT": env_int("TRIVIA_DB_STATEMENT_TIMEOUT"),
+        # no pooling in the app: PgBouncer (transaction mode) pools instead
+        "DB_PGBOUNCER": env_flag("TRIVIA_DB_PGBOUNCER"),
+    }
+
+
+# replica_config_from_env()
+#     read replica settings of the app config: the comma separated
+#     TRIVIA_DATABASE_REPLICA_URLS, and TRIVIA_DB_REPLICA_LAG, the seconds
+#     after a write during which the writer keeps reading from the primary
+
+def replica_config_from_env():
+    urls = os.environ.get("TRIVIA_DATABASE_REPLICA_URLS", "")
+    config = {
+        "DB_REPLICA_URLS": [url.strip() for url in urls.split(",")
+                            if url.strip()],
+    }
+    lag = env_int("TRIVIA_DB_REPLICA_LAG")
+    if lag is not None:
+        config["DB_REPLICA_LAG"] = lag
+    return config
+
+
+def replica_binds(urls):
+    return {f"{REPLICA_BIND_PREFIX}{i}": url for i, url in enumerate(urls)}
+
+
+# use_replica()
+#     sends the reads of the current session to a random replica, if any
+#     is configured. Returns the bind key of the replica or None
+
+def use_replica(session=None, rng=random):
+    session = session or db.session()
+    replicas = [bind for bind in session.app.config.get("SQLALCHEMY_BINDS")
+                or () if bind.startswith(REPLICA_BIND_PREFIX)]
+    if not replicas:
+        return None
+    replica = rng.choice(replicas)
+    session.info['replica'] = replica
+    return replica
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long checkouts wait for a connection
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+
+def pool_metrics(engine):
+    pool = engine.pool
+    metrics = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        metrics.update({
+            "checkouts": pool.wait_count,
+            "wait_seconds_total": pool.wait_time,
+            "wait_seconds_max": pool.max_wait_time,
+        })
+    return metrics
+
+
+def engine_options(config, database_path):
+    options = {}
+    postgres = database_path.startswith("postgresql")
+
+    if postgres:
+        # run executemany() through psycopg2's execute_batch, sending many
+        # rows per round-trip (bulk question import and seeding)
+        options["use_batch_mode"] = True
+        statement_timeout = config.get("DB_STATEMENT_TIMEOUT")
+        if statement_timeout:
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={statement_timeout}"
+            }
+
+    if config.get("DB_PGBOUNCER"):
+        options["poolclass"] = NullPool
+    elif not database_path.startswith("sqlite"):
+        options["poolclass"] = TimedQueuePool
+        for key, option in (("DB_POOL_SIZE", "pool_size"),
+                            ("DB_MAX_OVERFLOW", "max_overflow"),
+                            ("DB_POOL_TIMEOUT", "pool_timeout"),
+                            ("DB_POOL_RECYCLE", "pool_recycle")):
+            if config.get(key) is not None:
+                options[option] = config[key]
+
+    if config.get("DB_POOL_PRE_PING"):
+        options["pool_pre_ping"] = True
+
+    return options
+
 
 # setup_db(app)
-#     binds a flask application and a SQLAlchemy service
+#     binds a flask application and a SQLAlchemy service. Engine options
+#     are built from the DB_* keys of the app config, and every URL of
+#     DB_REPLICA_URLS becomes a bind usable by use_replica()
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config, database_path)
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(
+        app.config.get("DB_REPLICA_URLS") or ())
     db.app = app
     db.init_app(app)
 
 
+# hash_question()
+#     digest of the normalized text of a question: case, spacing and a
+#     closing ".", "?" or "!" do not make two questions different, other
+#     symbols do ("2+2" is not "2-2"). Duplicates are found with one
+#     lookup in the unique index on it instead of comparing texts
+
+QUESTION_END = ".?!"
+
+
+def hash_question(text):
+    normalized = " ".join(text.casefold().split())
+    normalized = normalized.rstrip(QUESTION_END).rstrip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
 # Question
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # category listing, paginated by id
+        Index('ix_questions_category_id', 'category', 'id'),
+        # quiz picks per category and difficulty
+        Index('ix_questions_category_difficulty',
+              'category', 'difficulty', 'id'),
+        # difficulty filter across categories
+        Index('ix_questions_difficulty_id', 'difficulty', 'id'),
+        # duplicate detection
+        Index('ix_questions_question_hash', 'question_hash', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
     answer = Column(String, nullable=False)
     category = Column(Integer, ForeignKey('categories.id'), nullable=False)
     difficulty = Column(Integer, nullable=False)
+    # hash_question() of the question, NULL for rows stored before the
+    # column existed until deduplicate_questions() fills it in
+    question_hash = Column(String(40))
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -40,10 +277,104 @@ class Question(db.Model):
         self.category = category
         self.difficulty = difficulty
 
+    @validates('question')
+    def validate_question(self, key, question):
+        # the hash follows every assignment of the text, so that update()
+        # does not leave a stale one
+        self.question_hash = hash_question(question)
+        return question
+
     def insert(self):
         db.session.add(self)
         db.session.commit()
 
+    @classmethod
+    def duplicate_of(cls, text):
+        # id of the stored question with the same normalized text, None
+        # if there is none
+        return db.session.query(cls.id) \
+            .filter(cls.question_hash == hash_question(text)).scalar()
+
+    @classmethod
+    def bulk_insert(cls, rows, batch_size=BULK_INSERT_BATCH_SIZE,
+                    on_duplicate=None):
+        # Inserts an iterable of column dicts with one executemany() per
+        # batch, without building ORM objects. Runs in the caller's
+        # transaction: committing is left to the caller.
+        # Rows whose question is already stored, or repeats an earlier row,
+        # are skipped: on_duplicate(position, duplicate_of) is called with
+        # the position of the row in `rows` and the id of the stored
+        # question (None for a repeat). Stored duplicates are looked up
+        # with one query per batch.
+        # Returns the number of inserted rows.
+        count = 0
+        seen = set()
+        batch = []
+
+        # one bound parameter expanded at execution: compiling an IN list
+        # of a whole batch costs more than the lookup
+        find_stored = select([cls.question_hash, cls.id]).where(
+            cls.question_hash.in_(bindparam('hashes', expanding=True)))
+
+        def insert(batch):
+            stored = dict(db.session.execute(find_stored, {
+                'hashes': [row['question_hash'] for _, row in batch]
+            }).fetchall())
+            new_rows = []
+            for position, row in batch:
+                if row['question_hash'] in stored:
+                    if on_duplicate is not None:
+                        on_duplicate(position, stored[row['question_hash']])
+                else:
+                    new_rows.append(row)
+            if new_rows:
+                db.session.execute(cls.__table__.insert(), new_rows)
+            return len(new_rows)
+
+        for position, row in enumerate(rows):
+            digest = hash_question(row['question'])
+            if digest in seen:
+                if on_duplicate is not None:
+                    on_duplicate(position, None)
+                continue
+            seen.add(digest)
+
+            batch.append((position, dict(row, question_hash=digest)))
+            if len(batch) == batch_size:
+                count += insert(batch)
+                batch = []
+        if batch:
+            count += insert(batch)
+
+        if count:
+            mark_questions_changed()
+        return count
+
+    @classmethod
+    def delete_where(cls, *criteria):
+        # Deletes every question matching `criteria` with one DELETE
+        # statement, without loading them. Runs in the caller's
+        # transaction. Returns the number of deleted rows.
+        count = db.session.query(cls).filter(*criteria) \
+            .delete(synchronize_session=False)
+        if count:
+            mark_questions_changed()
+        return count
+
+    @classmethod
+    def update_where(cls, values, *criteria):
+        # Sets the column `values` of every question matching `criteria`
+        # with one UPDATE statement. Runs in the caller's transaction.
+        # Returns the number of updated rows.
+        if 'question' in values:
+            values = dict(values,
+                          question_hash=hash_question(values['question']))
+        count = db.session.query(cls).filter(*criteria) \
+            .update(values, synchronize_session=False)
+        if count:
+            mark_questions_changed()
+        return count
+
     def update(self):
         db.session.commit()
 
@@ -61,6 +392,74 @@ class Question(db.Model):
         }
 
 
+# deduplicate_questions()
+#     one pass over the questions in id order: keeps the first question of
+#     every normalized text, deletes the later ones and fills in missing
+#     hashes (rows stored before the question_hash column). Returns
+#     (deleted, hashed); committing is left to the caller and nothing is
+#     written with dry_run
+
+def deduplicate_questions(batch_size=BULK_INSERT_BATCH_SIZE, dry_run=False):
+    kept = set()
+    duplicates = []
+    missing = []
+    # ids of kept rows hashed by an older normalization
+    stale = []
+    rows = db.session.query(
+        Question.id, Question.question, Question.question_hash) \
+        .order_by(Question.id).yield_per(batch_size)
+    for question_id, text, stored_hash in rows:
+        digest = hash_question(text)
+        if digest in kept:
+            duplicates.append(question_id)
+            continue
+        kept.add(digest)
+        if stored_hash != digest:
+            missing.append({'question_id': question_id, 'digest': digest})
+            if stored_hash is not None:
+                stale.append(question_id)
+
+    if not dry_run:
+        # deleting and clearing stale hashes first frees the hashes that
+        # the kept rows take
+        for start in range(0, len(duplicates), batch_size):
+            Question.delete_where(
+                Question.id.in_(duplicates[start:start + batch_size]))
+        for start in range(0, len(stale), batch_size):
+            Question.update_where(
+                {'question_hash': None},
+                Question.id.in_(stale[start:start + batch_size]))
+
+        set_hash = Question.__table__.update() \
+            .where(Question.id == bindparam('question_id')) \
+            .values(question_hash=bindparam('digest'))
+        for start in range(0, len(missing), batch_size):
+            db.session.execute(set_hash, missing[start:start + batch_size])
+
+    return len(duplicates), len(missing)
+
+
+# question rows
+#     column-only query of questions. Rows are plain named tuples: no ORM
+#     object is built or tracked in the identity map, which is what list
+#     endpoints need to serialize large pages cheaply
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+# a question row built outside of a query (e.g. from an in-memory record)
+QuestionRow = namedtuple('QuestionRow', QUESTION_FIELDS)
+
+
+def question_rows(session=None):
+    session = session or db.session
+    return session.query(*(getattr(Question, f) for f in QUESTION_FIELDS))
+
+
+def format_question_row(row):
+    # same dict as Question.format()
+    return dict(zip(QUESTION_FIELDS, row))
+
+
 # Category
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -76,3 +475,38 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+# change tracking
+#     bumps the version of every table that a commit inserted into, updated
+#     or deleted from. Writes that bypass the unit of work (bulk
+#     insert/update/delete statements) call mark_changed() themselves
+
+def mark_changed(table, session=None):
+    session = session or db.session
+    session.info.setdefault('changed_tables', set()).add(table)
+
+
+def mark_questions_changed(session=None):
+    mark_changed(Question.__tablename__, session)
+
+
+@event.listens_for(db.session, 'after_flush')
+def track_changes(session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table in table_versions:
+            mark_changed(table, session)
+
+
+@event.listens_for(db.session, 'after_commit')
+def bump_versions(session):
+    for table in session.info.pop('changed_tables', ()):
+        table_versions[table].bump()
+        # tells the app to send the read-your-writes cookie
+        session.info['wrote'] = True
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('changed_tables', None)
@@ -1,16 +1,13 @@
-from datetime import timedelta, datetime
 import sys
-from models import db, setup_db, Question, Category
-from flaskr import create_app
+from models import db, Question, Category
 
 import json
-import random
 
-app = create_app()
 
-
-def main():
-    with open('seed_data.json') as json_file:
+def load_seed_data(path='seed_data.json'):
+    # inserts the categories and questions of a seed file into the
+    # database of the current app
+    with open(path) as json_file:
         data = json.load(json_file)
         print("Seeding...")
         try:
@@ -21,14 +18,20 @@ def main():
                 db.session.add(category_obj)
             db.session.commit()
 
-            for question in data['questions']:
-                question_obj = Question(question=question['question'],
-                                        answer=question["answer"],
-                                        difficulty=question["difficulty"],
-                                        category=question['category'],
-                                        )
-                db.session.add(question_obj)
+            # batched executemany() instead of one ORM object per question.
+            # Questions already stored are skipped, so seeding twice does
+            # not duplicate them
+            skipped = []
+            Question.bulk_insert(({
+                "question": question['question'],
+                "answer": question["answer"],
+                "difficulty": question["difficulty"],
+                "category": question['category'],
+            } for question in data['questions']),
+                on_duplicate=lambda position, _: skipped.append(position))
             db.session.commit()
+            if skipped:
+                print(f"Skipped {len(skipped)} duplicate questions.")
             print("Done seeding.")
         except Exception:
             db.session.rollback()
@@ -38,5 +41,13 @@ def main():
             db.session.close()
 
 
+def main():
+    from flaskr import create_app
+
+    app = create_app()
+    with app.app_context():
+        load_seed_data()
+
+
 if __name__ == "__main__":
     main()
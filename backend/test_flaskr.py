@@ -1,10 +1,25 @@
 import os
+import asyncio
+import gzip
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
 
-from flaskr import create_app, QUESTIONS_PER_PAGE
-from models import setup_db, Question, Category, db
+from flaskr import create_app, QUESTIONS_PER_PAGE, LAST_WRITE_COOKIE
+from flaskr.profiler import normalize_sql
+from flaskr.admission import AdmissionControl
+from flaskr.cache import LRUStore, ResponseCache
+from models import setup_db, engine_options, deduplicate_questions, \
+    Question, Category, db
+
+try:
+    import asgi
+except ImportError:
+    # requirements-asgi.txt is not installed
+    asgi = None
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -34,6 +49,39 @@ class TriviaTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
 
+    def explain(self, query):
+        # query plan as text, with sequential scans disabled on PostgreSQL
+        # so that the plan of a tiny test table still shows index use
+        dialect = db.engine.dialect
+        sql = str(query.statement.compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}))
+        if dialect.name == "postgresql":
+            db.session.execute("SET LOCAL enable_seqscan = off")
+            rows = db.session.execute(f"EXPLAIN {sql}")
+        else:
+            rows = db.session.execute(f"EXPLAIN QUERY PLAN {sql}")
+        return "\n".join(str(row) for row in rows)
+
+    # indexes
+    def test_category_listing_uses_index(self):
+        query = Question.query.filter(Question.category == 1) \
+            .order_by(Question.id).limit(10)
+
+        self.assertIn("ix_questions_category_id", self.explain(query))
+
+    def test_category_and_difficulty_filter_uses_index(self):
+        query = Question.query.filter(Question.category == 1) \
+            .filter(Question.difficulty == 2)
+
+        self.assertIn("ix_questions_category_difficulty",
+                      self.explain(query))
+
+    def test_difficulty_filter_uses_index(self):
+        query = Question.query.filter(Question.difficulty == 2) \
+            .order_by(Question.id)
+
+        self.assertIn("ix_questions_difficulty_id", self.explain(query))
+
     # get_categories
 
     def test_get_categories(self):
@@ -56,6 +104,35 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         self.assertEqual(len(body['categories']), 0)
 
+    def test_get_categories_sees_new_category(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result1 = self.client().get("/categories")
+        self.assertEqual(len(json.loads(result1.data)['categories']), 1)
+
+        db.session.add(Category(type="Sport"))
+        db.session.commit()
+
+        result2 = self.client().get("/categories")
+        self.assertEqual(len(json.loads(result2.data)['categories']), 2)
+
+    def test_get_categories_is_conditional(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result1 = self.client().get("/categories")
+        etag = result1.headers['ETag']
+
+        self.assertEqual(result1.status_code, 200)
+        self.assertIn("max-age", result1.headers['Cache-Control'])
+
+        result2 = self.client().get("/categories", headers={
+            "If-None-Match": etag
+        })
+
+        self.assertEqual(result2.status_code, 304)
+
     def test_categories_errored_for_bad_method(self):
         result = self.client().put("/categories")
 
@@ -106,6 +183,37 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(body['questions']), QUESTIONS_PER_PAGE)
         self.assertEqual(body['total_questions'], 12)
 
+    def test_questions_are_compressed(self):
+        app = create_app({
+            "COMPRESS_RESPONSES": True,
+            "COMPRESS_MIN_SIZE": 1,
+            "JSON_BACKEND": "json",
+        })
+        setup_db(app, self.database_path)
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        db.session.add(Question(
+            question="question1",
+            answer="answer1",
+            difficulty=1,
+            category=1))
+        db.session.commit()
+
+        result = app.test_client().get("/questions", headers={
+            "Accept-Encoding": "gzip"
+        })
+        body = json.loads(gzip.decompress(result.data))
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.headers['Content-Encoding'], "gzip")
+        self.assertEqual(body['questions'][0], {
+            'id': 1,
+            'question': 'question1',
+            'answer': 'answer1',
+            'difficulty': 1,
+            'category': 1,
+        })
+
     def test_get_empty_question_list_from_first_page(self):
         result = self.client().get("/questions")
 
@@ -119,11 +227,149 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(result.status_code, 404)
 
+    def test_questions_are_paginated_by_cursor(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        for i in range(12):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=1))
+        db.session.commit()
+
+        result1 = self.client().get("/questions")
+        body1 = json.loads(result1.data)
+
+        self.assertEqual(result1.status_code, 200)
+        self.assertTrue(body1['next_cursor'])
+
+        result2 = self.client().get(
+            f"/questions?cursor={body1['next_cursor']}")
+        body2 = json.loads(result2.data)
+
+        self.assertEqual(result2.status_code, 200)
+        self.assertEqual(len(body2['questions']), 2)
+        self.assertEqual(body2['questions'][0]['id'], 11)
+        self.assertEqual(body2['total_questions'], 12)
+        self.assertEqual(body2['next_cursor'], None)
+
+        result3 = self.client().get("/questions?after_id=10")
+        body3 = json.loads(result3.data)
+
+        self.assertEqual(body3['questions'], body2['questions'])
+
+    def test_questions_total_follows_writes(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result1 = self.client().get("/questions")
+        self.assertEqual(json.loads(result1.data)['total_questions'], 0)
+
+        self.client().post("/questions", json=dict(
+            question="question1",
+            answer="answer1",
+            difficulty=1,
+            category=1
+        ))
+        result2 = self.client().get("/questions")
+        self.assertEqual(json.loads(result2.data)['total_questions'], 1)
+
+        self.client().delete("/questions/1")
+        result3 = self.client().get("/questions")
+        self.assertEqual(json.loads(result3.data)['total_questions'], 0)
+
+    def test_questions_are_conditional(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result1 = self.client().get("/questions")
+        etag = result1.headers['ETag']
+
+        result2 = self.client().get("/questions", headers={
+            "If-None-Match": etag
+        })
+
+        self.assertEqual(result2.status_code, 304)
+
+        self.client().post("/questions", json=dict(
+            question="question1",
+            answer="answer1",
+            difficulty=1,
+            category=1
+        ))
+        result3 = self.client().get("/questions", headers={
+            "If-None-Match": etag
+        })
+
+        self.assertEqual(result3.status_code, 200)
+        self.assertEqual(json.loads(result3.data)['total_questions'], 1)
+
+    def test_questions_with_invalid_cursor(self):
+        result = self.client().get("/questions?cursor=not-a-cursor")
+
+        self.assertEqual(result.status_code, 400)
+
     def test_categories_errored_for_bad_method(self):
         result = self.client().put("/questions")
 
         self.assertEqual(result.status_code, 405)
 
+    # export_questions
+    def test_export_questions_with_invalid_filter(self):
+        self.add_questions(2)
+
+        for name in ("category", "difficulty"):
+            result = self.client().get(f"/questions/export?{name}=abc")
+            body = json.loads(result.data)
+
+            self.assertEqual(result.status_code, 400)
+            self.assertEqual(body['message'], f"Field: {name} is invalid")
+
+    def test_export_questions_as_ndjson(self):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Sport"))
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=i + 1,
+                category=i % 2 + 1))
+        db.session.commit()
+
+        result = self.client().get("/questions/export?category=1")
+        lines = result.data.decode().splitlines()
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 3])
+
+    def test_export_questions_as_csv(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=i + 1,
+                category=1))
+        db.session.commit()
+
+        result = self.client().get("/questions/export?format=csv&difficulty=2")
+        lines = result.data.decode().splitlines()
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(lines, [
+            "id,question,answer,category,difficulty",
+            "2,question1,answer1,1,2",
+        ])
+
+    def test_export_questions_with_invalid_format(self):
+        result = self.client().get("/questions/export?format=xml")
+
+        self.assertEqual(result.status_code, 400)
+
     # delete_questions
     def test_delete_questions(self):
         db.session.add(Category(type="Art"))
@@ -149,6 +395,120 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(result.status_code, 404)
 
+    def add_questions(self, count):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for i in range(count):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1 + i % 2,
+                category=1 + i % 2))
+        db.session.commit()
+
+    def test_bulk_delete_questions_by_ids(self):
+        self.add_questions(4)
+
+        result = self.client().delete("/questions", json={"ids": [1, 2, 9]})
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['deleted'], 2)
+        self.assertEqual([q.id for q in Question.query.order_by("id")],
+                         [3, 4])
+
+    def test_bulk_delete_questions_by_filter(self):
+        self.add_questions(4)
+
+        result = self.client().delete("/questions", json={
+            "category": 2,
+            "difficulty": 2
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(body['deleted'], 2)
+        self.assertEqual(Question.query.filter_by(category=2).count(), 0)
+
+    def test_bulk_delete_questions_needs_a_filter(self):
+        self.add_questions(2)
+
+        result = self.client().delete("/questions", json={})
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(Question.query.count(), 2)
+
+    # update_question
+    def test_update_question(self):
+        self.add_questions(2)
+
+        result = self.client().patch("/questions/1", json={
+            "answer": "new answer",
+            "category": "2"
+        })
+        question = Question.query.get(1)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(question.answer, "new answer")
+        self.assertEqual(question.category, 2)
+        self.assertEqual(question.question, "question0")
+
+    def test_update_question_with_invalid_field(self):
+        self.add_questions(1)
+
+        result = self.client().patch("/questions/1", json={"difficulty": 9})
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(body['message'], "Field: difficulty is invalid")
+
+    def test_update_question_not_found(self):
+        self.add_questions(1)
+
+        result = self.client().patch("/questions/5", json={"answer": "a"})
+
+        self.assertEqual(result.status_code, 404)
+
+    def test_bulk_update_questions(self):
+        self.add_questions(4)
+
+        result = self.client().patch("/questions", json={
+            "category": 1,
+            "set": {"difficulty": 5}
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(body['updated'], 2)
+        self.assertEqual(
+            [q.difficulty for q in Question.query.order_by("id")],
+            [5, 2, 5, 2])
+
+    def test_update_question_to_duplicate_text(self):
+        self.add_questions(2)
+
+        result = self.client().patch("/questions/2", json={
+            "question": "Question0?"
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 409)
+        self.assertEqual(body['duplicate_of'], 1)
+        self.assertEqual(Question.query.get(2).question, "question1")
+
+    def test_bulk_update_questions_rejects_shared_question_text(self):
+        self.add_questions(4)
+
+        result = self.client().patch("/questions", json={
+            "category": 1,
+            "set": {"question": "same"}
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(body['message'], "Field: question is invalid")
+        self.assertEqual(Question.query.filter_by(question="same").count(),
+                         0)
+
     # create_question
     def test_create_question_adds_new_question(self):
         db.session.add(Category(type="Art"))
@@ -164,6 +524,168 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         self.assertEqual(Question.query.count(), 1)
 
+    def test_create_question_rejects_duplicate(self):
+        self.add_questions(1)
+
+        result = self.client().post("/questions", json=dict(
+            question="  QUESTION0! ",
+            answer="answer",
+            difficulty=1,
+            category=1
+        ))
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 409)
+        self.assertEqual(body['duplicate_of'], 1)
+        self.assertEqual(Question.query.count(), 1)
+
+    def test_create_question_with_non_string_question(self):
+        self.add_questions(1)
+
+        result = self.client().post("/questions", json=dict(
+            question=123,
+            answer="answer",
+            difficulty=1,
+            category=1
+        ))
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(body['message'], "Field: question is invalid")
+
+    def test_create_questions_differing_in_symbols(self):
+        self.add_questions(1)
+
+        for text in ["What is 2+2?", "What is 2-2?",
+                     "Who created C++?", "Who created C#?"]:
+            result = self.client().post("/questions", json=dict(
+                question=text,
+                answer="answer",
+                difficulty=1,
+                category=1
+            ))
+            self.assertEqual(result.status_code, 200)
+        self.assertEqual(Question.query.count(), 5)
+
+    def test_bulk_create_questions_reports_non_string_question(self):
+        self.add_questions(1)
+
+        result = self.client().post("/questions/bulk", json=[
+            dict(question=123, answer="answer", difficulty=1, category=1),
+            dict(question="new", answer=["answer"],
+                 difficulty=1, category=1),
+            dict(question="other", answer="answer",
+                 difficulty=1, category=1),
+        ])
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['inserted'], 1)
+        self.assertEqual(body['errors'], [{
+            "index": 0,
+            "message": "Field: question is invalid"
+        }, {
+            "index": 1,
+            "message": "Field: answer is invalid"
+        }])
+
+    def test_question_hash_follows_text(self):
+        self.add_questions(2)
+        question = Question.query.get(2)
+
+        question.question = "renamed"
+        question.update()
+
+        self.assertEqual(Question.duplicate_of("Renamed?"), 2)
+        self.assertIsNone(Question.duplicate_of("question1"))
+
+    def test_bulk_create_questions_reports_duplicates(self):
+        self.add_questions(1)
+
+        result = self.client().post("/questions/bulk", json=[
+            dict(question="new", answer="answer", difficulty=1, category=1),
+            dict(question="Question0", answer="answer",
+                 difficulty=1, category=1),
+            dict(question="New.", answer="answer", difficulty=1, category=1),
+        ])
+        body = json.loads(result.data)
+
+        self.assertEqual(body['inserted'], 1)
+        self.assertEqual(body['errors'], [{
+            "index": 1,
+            "message": "Duplicate question",
+            "duplicate_of": 1
+        }, {
+            "index": 2,
+            "message": "Duplicate question",
+            "duplicate_of": None
+        }])
+        self.assertEqual(Question.query.count(), 2)
+
+    def test_deduplicate_questions(self):
+        # rows stored before the question_hash column
+        self.add_questions(2)
+        db.session.execute(Question.__table__.insert(), [
+            dict(question=text, answer="answer", difficulty=1, category=1)
+            for text in ["Question0?", "other", "OTHER"]
+        ])
+        Question.query.update({"question_hash": None})
+        db.session.commit()
+
+        deleted, hashed = deduplicate_questions()
+        db.session.commit()
+
+        self.assertEqual((deleted, hashed), (2, 3))
+        self.assertEqual(
+            [q.question for q in Question.query.order_by("id")],
+            ["question0", "question1", "other"])
+        self.assertEqual(Question.query.filter(
+            Question.question_hash.is_(None)).count(), 0)
+
+    def test_bulk_create_questions_reports_invalid_rows(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result = self.client().post("/questions/bulk", json=[
+            dict(question="question1", answer="answer1",
+                 difficulty=1, category=1),
+            dict(question="question2", answer="answer2",
+                 difficulty=1, category=2),
+            dict(question="question3", answer="answer3",
+                 difficulty=5, category=1),
+        ])
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['inserted'], 2)
+        self.assertEqual(body['errors'], [{
+            "index": 1,
+            "message": "Field: category is invalid"
+        }])
+        self.assertEqual(Question.query.count(), 2)
+
+    def test_bulk_create_questions_from_ndjson(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        lines = [
+            json.dumps(dict(question="question1", answer="answer1",
+                            difficulty=1, category=1)),
+            "{not json",
+            json.dumps(dict(question="question2", answer="answer2",
+                            difficulty=2, category=1)),
+        ]
+
+        result = self.client().post(
+            "/questions/bulk",
+            data="\n".join(lines),
+            content_type="application/x-ndjson")
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['inserted'], 2)
+        self.assertEqual(body['errors'][0]['index'], 1)
+        self.assertEqual(Question.query.count(), 2)
+
     # search questions
     def test_search_questions_with_results(self):
         db.session.add(Category(type="Art"))
@@ -198,6 +720,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(result2.status_code, 200)
         self.assertEqual(len(body2['questions']), 1)
 
+    def test_search_questions_are_ranked_and_paginated(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        db.session.add(Question(
+            question="a painting",
+            answer="answer",
+            difficulty=1,
+            category=1))
+        for i in range(11):
+            db.session.add(Question(
+                question=f"painting of painting {i}",
+                answer="answer",
+                difficulty=1,
+                category=1))
+        db.session.commit()
+
+        result1 = self.client().post("/questions", json=dict(
+            searchTerm="PAINT"
+        ))
+        body1 = json.loads(result1.data)
+
+        self.assertEqual(result1.status_code, 200)
+        self.assertEqual(len(body1['questions']), QUESTIONS_PER_PAGE)
+        self.assertEqual(body1['total_questions'], 12)
+        self.assertNotIn(1, [q['id'] for q in body1['questions']])
+
+        result2 = self.client().post("/questions", json=dict(
+            searchTerm="PAINT",
+            page=2
+        ))
+        body2 = json.loads(result2.data)
+
+        self.assertEqual(len(body2['questions']), 2)
+        self.assertEqual(body2['questions'][-1]['id'], 1)
+
     def test_search_questions_without_results(self):
         result = self.client().post("/questions", json=dict(
             searchTerm="quest"
@@ -228,6 +785,52 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(body['questions']), 1)
         self.assertEqual(body['current_category'], 1)
 
+    def test_questions_by_category_are_paginated(self):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Sport"))
+        db.session.commit()
+        for i in range(10):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=i % 2 + 1))
+        db.session.commit()
+
+        result1 = self.client().get("/categories/2/questions?per_page=3")
+        body1 = json.loads(result1.data)
+
+        self.assertEqual(result1.status_code, 200)
+        self.assertEqual([q['id'] for q in body1['questions']], [2, 4, 6])
+        self.assertEqual(body1['total_questions'], 5)
+
+        result2 = self.client().get(
+            "/categories/2/questions?per_page=3"
+            f"&cursor={body1['next_cursor']}")
+        body2 = json.loads(result2.data)
+
+        self.assertEqual([q['id'] for q in body2['questions']], [8, 10])
+        self.assertEqual(body2['next_cursor'], None)
+
+        result3 = self.client().get("/categories/2/questions?page=3")
+
+        self.assertEqual(result3.status_code, 404)
+
+    def test_questions_with_invalid_page_size(self):
+        result = self.client().get("/questions?per_page=1000")
+
+        self.assertEqual(result.status_code, 400)
+
+    def test_questions_with_invalid_page(self):
+        self.add_questions(4)
+        app, _ = self.create_profiled_app(QUESTION_INDEX=True)
+        client = app.test_client()
+
+        for path in ("/questions?page=0", "/questions?page=-1",
+                     "/categories/1/questions?page=-1"):
+            self.assertEqual(self.client().get(path).status_code, 400, path)
+            self.assertEqual(client.get(path).status_code, 400, path)
+
     def test_get_questions_by_category_without_question(self):
         category = Category(type="Art")
         db.session.add(category)
@@ -303,6 +906,43 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         self.assertEqual(body['question'], None)
 
+    def test_quiz_plays_every_question_once(self):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for i in range(6):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=i % 2 + 1))
+        db.session.commit()
+
+        previous_questions = []
+        for _ in range(3):
+            result = self.client().post("/quizzes", json={
+                "previous_questions": previous_questions,
+                "quiz_category": {
+                    "id": 1,
+                    "type": "Art"
+                }
+            })
+            question = json.loads(result.data)['question']
+
+            self.assertEqual(question['category'], 1)
+            self.assertNotIn(question['id'], previous_questions)
+            previous_questions.append(question['id'])
+
+        result = self.client().post("/quizzes", json={
+            "previous_questions": previous_questions,
+            "quiz_category": {
+                "id": 1,
+                "type": "Art"
+            }
+        })
+
+        self.assertEqual(json.loads(result.data)['question'], None)
+
     def test_get_random_questions_for_all_categories(self):
         db.session.add(Category(type="Art"))
         db.session.add(Category(type="Science"))
@@ -342,6 +982,805 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(result2.status_code, 200)
         self.assertTrue(body['question'])
 
+    # Quiz batches
+    def test_quiz_batch_returns_distinct_unseen_questions(self):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for i in range(10):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=1 + i % 2))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/batch", json={
+            "previous_questions": [1],
+            "quiz_category": {"id": 1, "type": "Art"},
+            "count": 3
+        })
+        body = json.loads(result.data)
+        ids = [q['id'] for q in body['questions']]
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(set(ids)), 3)
+        self.assertNotIn(1, ids)
+        self.assertTrue(all(q['category'] == 1 for q in body['questions']))
+
+        result = self.client().post("/quizzes/batch", json={
+            "previous_questions": [1, 3, 5],
+            "quiz_category": {"id": 1, "type": "Art"},
+            "count": 10
+        })
+
+        self.assertEqual(
+            sorted(q['id'] for q in json.loads(result.data)['questions']),
+            [7, 9])
+
+    def test_quiz_batch_by_difficulty(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        for i in range(15):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1 + i % 5,
+                category=1))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/batch", json={
+            "count": 5,
+            "by_difficulty": True
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([q['difficulty'] for q in body['questions']],
+                         [1, 2, 3, 4, 5])
+
+    def test_quiz_batch_with_invalid_count(self):
+        result = self.client().post("/quizzes/batch", json={"count": 0})
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(body['message'], "Field: count is invalid")
+
+    # Adaptive quizzes
+    def test_adaptive_quiz_ramps_difficulty(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        for i in range(10):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1 + i % 5,
+                category=1))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/adaptive", json={
+            "difficulty": 2,
+            "answers": [True, True, False, True]
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['difficulty'], 4)
+        self.assertEqual(body['question']['difficulty'], 4)
+
+        # difficulty 4 played out: the nearest one is picked
+        result = self.client().post("/quizzes/adaptive", json={
+            "difficulty": 4,
+            "previous_questions": [4, 9]
+        })
+
+        self.assertEqual(
+            json.loads(result.data)['question']['difficulty'], 3)
+
+    def test_adaptive_quiz_mixes_weighted_categories(self):
+        for name in ("Art", "Science", "History"):
+            db.session.add(Category(type=name))
+        db.session.commit()
+        for i in range(30):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=1 + i % 3))
+        db.session.commit()
+
+        categories = set()
+        seen = []
+        for _ in range(20):
+            result = self.client().post("/quizzes/adaptive", json={
+                "categories": {"1": 1, "2": 3},
+                "previous_questions": seen
+            })
+            question = json.loads(result.data)['question']
+            categories.add(question['category'])
+            seen.append(question['id'])
+
+        self.assertEqual(categories, {1, 2})
+        self.assertEqual(len(set(seen)), 20)
+
+    def test_adaptive_quiz_with_invalid_weights(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/adaptive", json={
+            "categories": {"1": -1}
+        })
+        unknown = self.client().post("/quizzes/adaptive", json={
+            "categories": [5]
+        })
+
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(unknown.status_code, 404)
+
+    # Quiz sessions
+    def test_quiz_session_plays_every_question_once(self):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for i in range(4):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=i % 2 + 1))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/sessions", json={
+            "quiz_category": {
+                "id": 2,
+                "type": "Science"
+            }
+        })
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(body['total_questions'], 2)
+
+        session_id = body['session_id']
+        played = []
+        for _ in range(2):
+            result = self.client().post(f"/quizzes/sessions/{session_id}/next")
+            question = json.loads(result.data)['question']
+            self.assertEqual(question['category'], 2)
+            played.append(question['id'])
+
+        self.assertEqual(sorted(played), [2, 4])
+
+        result = self.client().post(f"/quizzes/sessions/{session_id}/next")
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data)['question'], None)
+
+    def test_quiz_session_limits_questions(self):
+        db.session.add(Category(type="Art"))
+        db.session.commit()
+        for i in range(4):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1,
+                category=1))
+        db.session.commit()
+
+        result = self.client().post("/quizzes/sessions", json={
+            "quiz_category": {
+                "id": None,
+                "type": "ALL"
+            },
+            "max_questions": 3
+        })
+
+        self.assertEqual(json.loads(result.data)['total_questions'], 3)
+
+    def test_quiz_batch_with_list_body(self):
+        self.add_questions(2)
+
+        result = self.client().post("/quizzes/batch", json=[1])
+
+        self.assertEqual(result.status_code, 400)
+
+    def test_adaptive_quiz_with_list_body(self):
+        self.add_questions(2)
+
+        result = self.client().post("/quizzes/adaptive", json=[1])
+
+        self.assertEqual(result.status_code, 400)
+
+    def test_quiz_session_with_invalid_body(self):
+        self.add_questions(2)
+
+        for body, message in [
+            ([1], "Bad request"),
+            ({"quiz_category": "Art"}, "Field: quiz_category is invalid"),
+            ({"quiz_category": {"id": 1}},
+             "Field: quiz_category is invalid"),
+        ]:
+            for path in ("/quizzes", "/quizzes/sessions"):
+                result = self.client().post(path, json=body)
+                self.assertEqual(result.status_code, 400, (path, body))
+                self.assertEqual(json.loads(result.data)['message'],
+                                 message, (path, body))
+
+    def test_quiz_session_size_is_capped(self):
+        self.add_questions(6)
+        app = create_app({"QUIZ_SESSION_QUESTIONS": 4})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        default = client.post("/quizzes/sessions", json={})
+        too_many = client.post("/quizzes/sessions",
+                               json={"max_questions": 5})
+
+        self.assertEqual(json.loads(default.data)['total_questions'], 4)
+        self.assertEqual(too_many.status_code, 400)
+
+    def test_quiz_session_not_found(self):
+        result = self.client().post("/quizzes/sessions/unknown/next")
+
+        self.assertEqual(result.status_code, 404)
+
+    # connection pool
+    def test_pool_is_configurable(self):
+        options = engine_options({
+            "DB_POOL_SIZE": 3,
+            "DB_MAX_OVERFLOW": 2,
+            "DB_POOL_RECYCLE": 600,
+            "DB_POOL_PRE_PING": True,
+        }, "postgresql://postgres@localhost:5432/trivia_test")
+
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertEqual(options["pool_recycle"], 600)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_pool_is_disabled_for_pgbouncer(self):
+        options = engine_options(
+            {"DB_PGBOUNCER": True, "DB_POOL_SIZE": 3},
+            "postgresql://postgres@localhost:5432/trivia_test")
+
+        self.assertEqual(options["poolclass"], NullPool)
+        self.assertNotIn("pool_size", options)
+
+    # read replicas
+    def create_replica_app(self, lag):
+        # app reading from a "replica" bound to the test database, and the
+        # statements run on that replica
+        app = create_app({
+            "DB_REPLICA_URLS": [self.database_path],
+            "DB_REPLICA_LAG": lag,
+        })
+        setup_db(app, self.database_path)
+        statements = []
+        with app.app_context():
+            event.listen(db.get_engine(app, "replica0"),
+                         "before_cursor_execute",
+                         lambda *args: statements.append(args[2]))
+        return app, statements
+
+    def test_reads_are_routed_to_replica(self):
+        app, statements = self.create_replica_app(lag=0)
+
+        result = app.test_client().get("/questions")
+
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(statements)
+
+    def test_response_cache_store_is_shared(self):
+        self.add_questions(2)
+        store = LRUStore()
+        clients = []
+        for _ in range(2):
+            app = create_app({"RESPONSE_CACHE_STORE": store})
+            setup_db(app, self.database_path)
+            clients.append(app.test_client())
+        clients[0].get("/questions")
+
+        # a write made by another worker, not seen by the version counters
+        db.session.execute(Question.__table__.insert(), [dict(
+            question="new", answer="answer", difficulty=1, category=1)])
+        db.session.commit()
+        stale = json.loads(clients[1].get("/questions").data)
+        # the other worker's cache replaces the generation of the store
+        ResponseCache(store).invalidate()
+        fresh = json.loads(clients[1].get("/questions").data)
+
+        self.assertEqual(stale['total_questions'], 2)
+        self.assertEqual(fresh['total_questions'], 3)
+
+    def last_write_cookie(self, when):
+        # LAST_WRITE_COOKIE as the app sets it after a write at `when`
+        signer = self.app.extensions['trivia_last_write_signer']
+        return signer.sign(str(when)).decode()
+
+    def test_client_reads_its_writes_past_the_caches(self):
+        self.add_questions(2)
+        client = self.client()
+        client.get("/questions")
+        client.get("/categories/1/questions")
+
+        # a write made by another worker: the version counters of this
+        # process do not move
+        db.session.execute(Question.__table__.insert(), [dict(
+            question="new", answer="answer", difficulty=1, category=1)])
+        db.session.commit()
+
+        stale = json.loads(client.get("/questions").data)
+        client.set_cookie("localhost", LAST_WRITE_COOKIE,
+                          self.last_write_cookie(time.time()))
+        fresh = json.loads(client.get("/questions").data)
+        category = json.loads(client.get("/categories/1/questions").data)
+
+        self.assertEqual(stale['total_questions'], 2)
+        self.assertEqual(fresh['total_questions'], 3)
+        self.assertEqual(category['total_questions'], 2)
+        self.assertEqual(category['questions'][-1]['question'], "new")
+
+    def test_made_up_last_write_cookies_are_ignored(self):
+        self.add_questions(2)
+        client = self.client()
+        client.get("/questions")
+        db.session.execute(Question.__table__.insert(), [dict(
+            question="new", answer="answer", difficulty=1, category=1)])
+        db.session.commit()
+
+        for value in (str(time.time()), "inf", "1e18",
+                      self.last_write_cookie(1e18),
+                      self.last_write_cookie(float("inf"))):
+            client.set_cookie("localhost", LAST_WRITE_COOKIE, value)
+            body = json.loads(client.get("/questions").data)
+            self.assertEqual(body['total_questions'], 2, value)
+
+    def test_client_reads_its_writes_from_primary(self):
+        app, statements = self.create_replica_app(lag=60)
+        client = app.test_client()
+        with app.app_context():
+            db.session.add(Category(type="Art"))
+            db.session.commit()
+
+        result = client.post("/questions", json={
+            "question": "question",
+            "answer": "answer",
+            "category": 1,
+            "difficulty": 1
+        })
+        self.assertIn("trivia_last_write=",
+                      result.headers.get("Set-Cookie", ""))
+
+        result = client.get("/questions")
+        body = json.loads(result.data)
+
+        self.assertEqual(body['total_questions'], 1)
+        self.assertEqual(statements, [])
+
+    # query profiling
+    def create_profiled_app(self, **config):
+        # app without response cache that profiles every request, and the
+        # {endpoint: QueryProfile} of its last requests
+        profiles = {}
+        app = create_app(dict({
+            "QUERY_PROFILING": True,
+            "QUERY_PROFILE_LISTENER": profiles.__setitem__,
+            "RESPONSE_CACHE": False,
+        }, **config))
+        setup_db(app, self.database_path)
+        return app, profiles
+
+    def test_query_budgets(self):
+        self.add_questions(20)
+        app, profiles = self.create_profiled_app()
+        client = app.test_client()
+
+        client.get("/questions")
+        client.get("/categories/1/questions")
+        client.post("/quizzes", json={"previous_questions": []})
+        client.post("/quizzes/batch", json={"count": 5})
+
+        # statements with the caches of the app warmed by the requests
+        # before: the page, the counts and the categories, then only the
+        # page, the quiz id pool and the picked questions
+        budgets = {
+            "get_questions": 3,
+            "get_category_questions": 1,
+            "quizzes": 2,
+            "quizzes_batch": 1,
+        }
+        for endpoint, budget in budgets.items():
+            profile = profiles[endpoint]
+            self.assertLessEqual(profile.count, budget, endpoint)
+            self.assertEqual(profile.duplicates(), {}, endpoint)
+            self.assertEqual(profile.n_plus_one(), {}, endpoint)
+
+    def test_question_index_serves_quizzes_without_queries(self):
+        self.add_questions(20)
+        app, profiles = self.create_profiled_app(QUESTION_INDEX=True)
+        client = app.test_client()
+
+        client.get("/categories")
+        quiz = client.post("/quizzes", json={
+            "previous_questions": [],
+            "quiz_category": {"id": 2, "type": "Science"}
+        })
+        batch = client.post("/quizzes/batch", json={"count": 5})
+        page = client.get("/categories/1/questions?per_page=4&page=2")
+        body = json.loads(page.data)
+
+        self.assertEqual(json.loads(quiz.data)['question']['category'], 2)
+        self.assertEqual(len(json.loads(batch.data)['questions']), 5)
+        self.assertEqual([q['id'] for q in body['questions']],
+                         [9, 11, 13, 15])
+        self.assertEqual(body['total_questions'], 10)
+        self.assertTrue(body['next_cursor'])
+        for endpoint in ("quizzes", "quizzes_batch",
+                         "get_category_questions"):
+            self.assertEqual(profiles[endpoint].count, 0, endpoint)
+
+    def test_question_index_follows_writes(self):
+        self.add_questions(2)
+        app, _ = self.create_profiled_app(QUESTION_INDEX=True)
+        client = app.test_client()
+        client.get("/categories/1/questions")
+
+        client.post("/questions", json={
+            "question": "new",
+            "answer": "answer",
+            "category": 1,
+            "difficulty": 1
+        })
+        client.delete("/questions/1")
+        body = json.loads(client.get("/categories/1/questions").data)
+
+        self.assertEqual([q['question'] for q in body['questions']],
+                         ["new"])
+
+    def test_query_profile_flags_n_plus_one(self):
+        self.add_questions(3)
+        app, profiles = self.create_profiled_app()
+
+        @app.route("/test/n-plus-one")
+        def n_plus_one():
+            for question_id in (1, 2, 3, 3):
+                Question.query.get(question_id)
+                db.session.expunge_all()
+            return "ok"
+
+        result = app.test_client().get("/test/n-plus-one")
+        profile = profiles["n_plus_one"]
+
+        self.assertIn("db;dur=", result.headers["Server-Timing"])
+        self.assertEqual(profile.count, 4)
+        self.assertEqual(list(profile.n_plus_one().values()), [3])
+        self.assertEqual(list(profile.duplicates().values()), [2])
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM questions\n WHERE id IN "
+                          "(%(id_1)s, %(id_2)s) AND answer = 'a''b' "
+                          "LIMIT 10"),
+            "SELECT * FROM questions WHERE id IN (?) AND answer = ? "
+            "LIMIT ?")
+
+    # admission control
+    def test_search_is_rate_limited_per_client(self):
+        app = create_app({"RATE_LIMITS": {"search": (0.01, 2)}})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        statuses = [
+            client.post("/questions", json={"searchTerm": "a"}).status_code
+            for _ in range(3)
+        ]
+        result = client.post("/questions", json={"searchTerm": "a"})
+        body = json.loads(result.data)
+        other_client = client.post(
+            "/questions", json={"searchTerm": "a"},
+            environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        quiz = client.post("/quizzes", json={"previous_questions": []})
+        text = client.get("/metrics").data.decode()
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(result.status_code, 429)
+        self.assertEqual(body['message'], "Too many requests")
+        self.assertGreaterEqual(int(result.headers['Retry-After']), 1)
+        self.assertEqual(other_client.status_code, 200)
+        self.assertEqual(quiz.status_code, 200)
+        self.assertIn('trivia_admission_rejected_total'
+                      '{route_class="search",reason="rate"} 2', text)
+        self.assertIn('trivia_admission_in_flight{route_class="quiz"} 0',
+                      text)
+
+    def test_concurrency_limit_rejects_beyond_queue(self):
+        admission = AdmissionControl(concurrency={"write": (1, 0, 0)})
+
+        self.assertTrue(admission.enter("write"))
+        self.assertFalse(admission.enter("write"))
+        self.assertTrue(admission.enter("search"))
+        admission.leave("write")
+        self.assertTrue(admission.enter("write"))
+
+    # metrics
+    def test_get_metrics(self):
+        self.client().get("/questions")
+        self.client().get("/questions?page=2")
+
+        result = self.client().get("/metrics")
+        text = result.data.decode()
+
+        self.assertEqual(result.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count'
+                      '{endpoint="get_questions",method="GET"} 2', text)
+        self.assertIn('trivia_requests_total'
+                      '{endpoint="get_questions",method="GET",status="404"} 1',
+                      text)
+        self.assertIn('trivia_errors_total{status="404"} 1', text)
+        self.assertIn('trivia_request_db_queries_count'
+                      '{endpoint="get_questions"} 2', text)
+
+    def test_get_pool_metrics(self):
+        result = self.client().get("/metrics/pool")
+        body = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertIn("pool", body['pool'])
+
+
+@unittest.skipIf(asgi is None, "needs requirements-asgi.txt")
+class TriviaAsgiTestCase(unittest.TestCase):
+    """The ASGI serving mode, driven over ASGI messages"""
+
+    def setUp(self):
+        self.database_name = "trivia_test"
+        self.database_username = "postgres"
+        self.database_path = "postgresql://{}@{}/{}".format(
+            self.database_username,
+            'localhost:5432',
+            self.database_name)
+
+    def tearDown(self):
+        # Clean up test database
+        db.session.remove()
+        db.drop_all()
+
+    def create_app(self, test_config=None):
+        # ASGI app over the test database, with its tables created
+        app = asgi.create_asgi_app(test_config, self.database_path)
+        db.create_all()
+        return app
+
+    def add_questions(self, count):
+        db.session.add(Category(type="Art"))
+        db.session.add(Category(type="Science"))
+        db.session.commit()
+        for i in range(count):
+            db.session.add(Question(
+                question=f"question{i}",
+                answer=f"answer{i}",
+                difficulty=1 + i % 2,
+                category=1 + i % 2))
+        db.session.commit()
+
+    def serve(self, app, session):
+        # result of the coroutine function `session`, called with a
+        # request function, between the startup and shutdown of `app`
+        async def request(method, path, body=None, headers=None):
+            # (status, headers, body) of the response
+            path, _, query = path.partition("?")
+            data = body if isinstance(body, bytes) else \
+                json.dumps(body).encode() if body is not None else b""
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": method,
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": query.encode(),
+                "root_path": "",
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(data)).encode()),
+                ] + [(name.lower().encode(), value.encode())
+                     for name, value in (headers or {}).items()],
+                "client": ("127.0.0.1", 50000),
+                "server": ("testserver", 80),
+            }
+            messages = [{"type": "http.disconnect"},
+                        {"type": "http.request", "body": data}]
+            response = {"body": b""}
+
+            async def receive():
+                if len(messages) > 1:
+                    return messages.pop()
+                return messages[0]
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = {
+                        name.decode().lower(): value.decode()
+                        for name, value in message["headers"]}
+                else:
+                    response["body"] += message.get("body", b"")
+
+            await app(scope, receive, send)
+            return response["status"], response["headers"], response["body"]
+
+        async def run():
+            received = asyncio.Queue()
+            sent = asyncio.Queue()
+            lifespan = asyncio.ensure_future(
+                app({"type": "lifespan"}, received.get, sent.put))
+            await received.put({"type": "lifespan.startup"})
+            await sent.get()
+            try:
+                return await session(request)
+            finally:
+                await received.put({"type": "lifespan.shutdown"})
+                await sent.get()
+                await lifespan
+
+        return asyncio.run(run())
+
+    def last_write_cookie(self, app, when):
+        signer = app.flask_app.extensions['trivia_last_write_signer']
+        return f"{LAST_WRITE_COOKIE}={signer.sign(str(when)).decode()}"
+
+    def test_get_questions_paginated(self):
+        app = self.create_app()
+        self.add_questions(QUESTIONS_PER_PAGE + 1)
+
+        async def session(request):
+            return [await request("GET", path) for path in [
+                "/questions", "/questions?page=2", "/questions?page=3",
+                "/questions?page=0", "/categories/1/questions",
+                "/categories/9/questions"]]
+
+        responses = self.serve(app, session)
+        statuses = [status for status, _, _ in responses]
+        first = json.loads(responses[0][2])
+        second = json.loads(responses[1][2])
+
+        self.assertEqual(statuses, [200, 200, 404, 400, 200, 404])
+        self.assertEqual(len(first['questions']), QUESTIONS_PER_PAGE)
+        self.assertEqual(first['total_questions'], QUESTIONS_PER_PAGE + 1)
+        self.assertEqual(len(second['questions']), 1)
+        self.assertEqual(json.loads(responses[3][2])['message'],
+                         "Bad request")
+        self.assertEqual(json.loads(responses[5][2])['message'],
+                         "Resource not found")
+
+    def test_questions_are_conditional(self):
+        app = self.create_app()
+        self.add_questions(2)
+
+        async def session(request):
+            first = await request("GET", "/questions")
+            etag = first[1]['etag']
+            second = await request("GET", "/questions",
+                                   headers={"If-None-Match": etag})
+            return etag, second
+
+        etag, (status, headers, body) = self.serve(app, session)
+
+        self.assertEqual(status, 304)
+        self.assertEqual(headers['etag'], etag)
+        self.assertEqual(body, b"")
+
+    def test_bridged_write_reloads_the_caches(self):
+        app = self.create_app()
+        self.add_questions(1)
+
+        async def session(request):
+            before = await request("GET", "/categories/1/questions")
+            quiz = await request("POST", "/quizzes", {
+                "previous_questions": [1],
+                "quiz_category": {"type": "Art", "id": 1}})
+            created = await request("POST", "/questions", {
+                "question": "new", "answer": "answer",
+                "difficulty": 1, "category": 1})
+            after = await request("GET", "/categories/1/questions")
+            next_quiz = await request("POST", "/quizzes", {
+                "previous_questions": [1],
+                "quiz_category": {"type": "Art", "id": 1}})
+            return before, quiz, created, after, next_quiz
+
+        before, quiz, created, after, next_quiz = self.serve(app, session)
+
+        self.assertEqual(json.loads(before[2])['total_questions'], 1)
+        self.assertIsNone(json.loads(quiz[2])['question'])
+        self.assertEqual(created[0], 200)
+        self.assertEqual(json.loads(after[2])['total_questions'], 2)
+        self.assertEqual(json.loads(next_quiz[2])['question']['question'],
+                         "new")
+
+    def test_client_reads_its_writes_past_the_caches(self):
+        app = self.create_app()
+        self.add_questions(1)
+
+        async def session(request):
+            await request("GET", "/questions")
+            await request("POST", "/quizzes", {"previous_questions": [1]})
+            # a write made by another worker: the version counters of this
+            # process do not move
+            db.session.execute(Question.__table__.insert(), [dict(
+                question="new", answer="answer", difficulty=1, category=1)])
+            db.session.commit()
+            cookie = {"Cookie": self.last_write_cookie(app, time.time())}
+            return [
+                await request("GET", "/questions"),
+                await request("GET", "/questions", headers=cookie),
+                await request("GET", "/categories/1/questions",
+                              headers=cookie),
+                await request("POST", "/quizzes", {"previous_questions": [1]},
+                              headers=cookie),
+            ]
+
+        stale, fresh, category, quiz = self.serve(app, session)
+
+        self.assertEqual(json.loads(stale[2])['total_questions'], 1)
+        self.assertEqual(json.loads(fresh[2])['total_questions'], 2)
+        self.assertEqual(json.loads(category[2])['total_questions'], 2)
+        self.assertEqual(json.loads(quiz[2])['question']['question'], "new")
+
+    def test_quizzes_are_rate_limited(self):
+        app = self.create_app({"RATE_LIMITS": {"quiz": (0.01, 2)}})
+        self.add_questions(2)
+
+        async def session(request):
+            return [await request("POST", "/quizzes",
+                                  {"previous_questions": []})
+                    for _ in range(3)]
+
+        responses = self.serve(app, session)
+        status, headers, body = responses[-1]
+
+        self.assertEqual([r[0] for r in responses], [200, 200, 429])
+        self.assertEqual(json.loads(body)['message'], "Too many requests")
+        self.assertGreaterEqual(int(headers['retry-after']), 1)
+
+    def test_quizzes_with_invalid_body(self):
+        app = self.create_app()
+        self.add_questions(2)
+
+        async def session(request):
+            return [await request("POST", "/quizzes", body) for body in [
+                [1, 2],
+                {"quiz_category": "Art"},
+                {"quiz_category": {"id": 1}},
+                {"previous_questions": ["a"]},
+                {"quiz_category": {"type": "Art", "id": 9}},
+                b"{not json",
+                b"",
+            ]]
+
+        responses = self.serve(app, session)
+        messages = [json.loads(body)['message']
+                    for _, _, body in responses]
+
+        self.assertEqual([status for status, _, _ in responses],
+                         [400, 400, 400, 400, 404, 400, 400])
+        self.assertEqual(messages[0], "Bad request")
+        self.assertEqual(messages[1], "Field: quiz_category is invalid")
+        self.assertEqual(messages[2], "Field: quiz_category is invalid")
+        self.assertEqual(messages[3], "Field: previous_questions is invalid")
+
+    def test_question_index_is_served_by_flask(self):
+        app = self.create_app({"QUESTION_INDEX": True})
+        self.add_questions(2)
+
+        async def session(request):
+            return await request("GET", "/categories/1/questions")
+
+        status, _, body = self.serve(app, session)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['total_questions'], 1)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -15,6 +15,8 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      // term of the search being paged through, null when listing
+      searchTerm: null,
     };
   }
 
@@ -32,6 +34,7 @@ class QuestionView extends Component {
           totalQuestions: result.total_questions,
           categories: result.categories,
           currentCategory: result.current_category,
+          searchTerm: null,
         });
         return;
       },
@@ -43,7 +46,11 @@ class QuestionView extends Component {
   };
 
   selectPage(num) {
-    this.setState({ page: num }, () => this.getQuestions());
+    this.setState({ page: num }, () =>
+      this.state.searchTerm === null
+        ? this.getQuestions()
+        : this.getSearchResults()
+    );
   }
 
   createPagination() {
@@ -74,6 +81,7 @@ class QuestionView extends Component {
           questions: result.questions,
           totalQuestions: result.total_questions,
           currentCategory: result.current_category,
+          searchTerm: null,
         });
         return;
       },
@@ -85,12 +93,19 @@ class QuestionView extends Component {
   };
 
   submitSearch = (searchTerm) => {
+    this.setState({ searchTerm: searchTerm, page: 1 }, this.getSearchResults);
+  };
+
+  getSearchResults = () => {
     $.ajax({
       url: `${BASE_URL}/questions`,
       type: "POST",
       dataType: "json",
       contentType: "application/json",
-      data: JSON.stringify({ searchTerm: searchTerm }),
+      data: JSON.stringify({
+        searchTerm: this.state.searchTerm,
+        page: this.state.page,
+      }),
       xhrFields: {
         withCredentials: true,
       },
@@ -12,6 +12,7 @@ class QuizView extends Component {
     this.state = {
       quizCategory: null,
       previousQuestions: [],
+      questions: [],
       showAnswer: false,
       categories: {},
       numCorrect: 0,
@@ -37,49 +38,57 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    this.setState({ quizCategory: { type, id } }, this.getQuestions);
   };
 
   handleChange = (event) => {
     this.setState({ [event.target.name]: event.target.value });
   };
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions];
-    if (this.state.currentQuestion.id) {
-      previousQuestions.push(this.state.currentQuestion.id);
-    }
-
+  getQuestions = () => {
+    // every question of the play in one request
     $.ajax({
-      url: `${BASE_URL}/quizzes`,
+      url: `${BASE_URL}/quizzes/batch`,
       type: "POST",
       dataType: "json",
       contentType: "application/json",
       data: JSON.stringify({
-        previous_questions: previousQuestions,
+        previous_questions: this.state.previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: questionsPerPlay,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: "",
-          forceEnd: result.question ? false : true,
-        });
+        this.setState({ questions: result.questions }, this.getNextQuestion);
         return;
       },
       error: (error) => {
-        alert("Unable to load question. Please try your request again");
+        alert("Unable to load questions. Please try your request again");
         return;
       },
     });
   };
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions];
+    if (this.state.currentQuestion.id) {
+      previousQuestions.push(this.state.currentQuestion.id);
+    }
+    const [nextQuestion, ...questions] = this.state.questions;
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      questions: questions,
+      currentQuestion: nextQuestion || {},
+      guess: "",
+      forceEnd: nextQuestion ? false : true,
+    });
+  };
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess
@@ -96,6 +105,7 @@ class QuizView extends Component {
     this.setState({
       quizCategory: null,
       previousQuestions: [],
+      questions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},